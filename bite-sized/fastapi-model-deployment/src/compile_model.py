@@ -0,0 +1,160 @@
+import time
+import numpy as np
+import pandas as pd
+import joblib
+from typing import List
+
+from src.serving_utils import CarData, FEATURE_NAMES
+
+MODEL_PATH = 'models/linear_regression_pipeline.pkl'
+DATASET_PATH = 'data/car_price_prediction.csv'
+
+
+class UnsupportedPipelineError(ValueError):
+    """
+    Raised when a pipeline can't be compiled (the pipeline itself should then be used).
+    """
+
+
+class CompiledLinearModel:
+    """
+    A fitted OneHotEncoder -> StandardScaler -> LinearRegression pipeline, folded into one lookup table per feature.
+
+    Since every feature is one-hot encoded, the prediction is the intercept plus one weight per feature (the regression
+    coefficient of its category, divided by the scale), i.e. a few dictionary lookups and a sum.
+    """
+
+    def __init__(self, intercept: float, tables: dict, handle_unknown: str = 'error'):
+        self.intercept = intercept
+        self.tables = tables  # feature name -> {category: weight}
+        self.handle_unknown = handle_unknown
+
+    def _weight(self, feature: str, value) -> float:
+
+        weight = self.tables[feature].get(value)
+
+        if weight is None:
+            if self.handle_unknown == 'error':  # same as the OneHotEncoder
+                raise ValueError(f'Found unknown category {value!r} in feature {feature!r}')
+            return 0.
+
+        return weight
+
+    def predict_one(self, data: CarData) -> float:
+        """
+        Predict the price of a single car (no DataFrame involved).
+        """
+
+        prediction = self.intercept
+
+        for feature in FEATURE_NAMES:
+            prediction += self._weight(feature, getattr(data, feature))
+
+        return prediction
+
+    def predict(self, X: pd.DataFrame) -> np.ndarray:
+        """
+        Drop-in replacement for `pipe.predict` on a DataFrame with the training columns.
+        """
+
+        predictions = np.full(len(X), self.intercept)
+
+        for feature in FEATURE_NAMES:
+            predictions += [self._weight(feature, value) for value in X[feature].tolist()]
+
+        return predictions
+
+    def predict_batch(self, data: List[CarData]) -> np.ndarray:
+        return np.array([self.predict_one(car) for car in data])
+
+
+def compile_pipeline(pipe) -> CompiledLinearModel:
+    """
+    Fold the encoder, scaler and regressor of a fitted pipeline into a CompiledLinearModel.
+
+    The scaler's mean (if it centers the data) is folded into the intercept:
+        b + sum(c * (x - m) / s) = (b - sum(c * m / s)) + sum((c / s) * x)
+
+    Raises UnsupportedPipelineError for pipelines that can't be folded this way.
+    """
+
+    encoder, scaler, regressor = (step for _, step in pipe.steps)
+
+    if encoder.drop is not None or getattr(encoder, '_infrequent_enabled', False):
+        raise UnsupportedPipelineError('Only OneHotEncoders without dropped or infrequent categories can be compiled')
+
+    if np.ndim(regressor.coef_) != 1:
+        raise UnsupportedPipelineError('Only single-target regressors can be compiled')
+
+    scale = scaler.scale_ if scaler.with_std else np.ones_like(regressor.coef_)
+    weights = regressor.coef_ / scale
+
+    intercept = float(regressor.intercept_)
+    if scaler.with_mean:
+        intercept -= float(np.dot(weights, scaler.mean_))
+
+    tables, offset = {}, 0
+    for feature, categories in zip(encoder.feature_names_in_, encoder.categories_):
+        tables[feature] = dict(zip(categories.tolist(), weights[offset:offset + len(categories)].tolist()))
+        offset += len(categories)
+
+    return CompiledLinearModel(intercept, tables, handle_unknown=encoder.handle_unknown)
+
+
+def check_equivalence(pipe, compiled: CompiledLinearModel, X: pd.DataFrame, rtol: float = 1e-9,
+                      atol: float = 1e-6) -> float:
+    """
+    Check that the compiled model gives the same predictions as the pipeline; returns the max absolute difference.
+    """
+
+    expected = pipe.predict(X)
+    actual = compiled.predict(X)
+
+    if not np.allclose(actual, expected, rtol=rtol, atol=atol):
+        raise AssertionError(f'Compiled model differs from the pipeline by up to {np.abs(actual - expected).max()}')
+
+    return float(np.abs(actual - expected).max())
+
+
+def category_sample(pipe) -> pd.DataFrame:
+    """
+    A small sample that contains every category the pipeline's encoder knows at least once, to check a compiled model
+    against without the training data.
+    """
+
+    encoder = pipe.steps[0][1]
+    num_rows = max(len(categories) for categories in encoder.categories_)
+
+    return pd.DataFrame({feature: [categories[i % len(categories)] for i in range(num_rows)]
+                         for feature, categories in zip(encoder.feature_names_in_, encoder.categories_)})
+
+
+def load_training_features(dataset_path: str = DATASET_PATH) -> pd.DataFrame:
+    """
+    The features the pipeline was trained on (same preprocessing as train.py).
+    """
+
+    df = pd.read_csv(dataset_path, index_col=0)
+
+    return df[FEATURE_NAMES].fillna(0)
+
+
+if __name__ == '__main__':
+
+    pipe = joblib.load(MODEL_PATH)
+    compiled = compile_pipeline(pipe)
+
+    max_difference = check_equivalence(pipe, compiled, load_training_features())
+
+    print(f'Compiled model matches the pipeline on the training data (max difference: {max_difference:.2e})')
+
+    car = CarData(Location='Hyderabad', Year=2008, Kilometers_Driven=90000, Fuel_Type='Diesel', Transmission='Manual',
+                  Owner_Type='Second')
+    row = pd.DataFrame([car.model_dump()], columns=FEATURE_NAMES)
+
+    for name, predict, n in [('pipeline', lambda: pipe.predict(row), 1_000),
+                             ('compiled', lambda: compiled.predict_one(car), 100_000)]:
+        start = time.perf_counter()
+        for _ in range(n):
+            predict()
+        print(f'{name}: {(time.perf_counter() - start) / n * 1e6:.1f} us per single-row prediction')
@@ -0,0 +1,109 @@
+import os
+import asyncio
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+
+def _worker_started() -> bool:
+    return True
+
+
+class Overloaded(Exception):
+    """
+    Raised when a request arrives while the maximum number of requests are already being served.
+    """
+
+
+class InferenceExecutor:
+    """
+    Runs model inference on a thread or process pool, so that it doesn't block the event loop, and limits the number
+    of requests in flight.
+
+    Requests over the limit are rejected immediately (`admit` raises Overloaded) instead of queueing up behind the
+    others, which keeps the latency of the accepted ones bounded. Functions run on a process pool must be picklable,
+    i.e. defined at module level; each worker imports their module (and loads its model) when it starts.
+
+    :param kind: 'thread' or 'process'
+    :param max_workers: size of the pool (the executor's default if None)
+    :param max_in_flight: maximum number of requests admitted at the same time
+    :param initializer: called in every process worker when it starts (e.g. to load the model)
+    """
+
+    def __init__(self, kind: str = 'thread', max_workers: int = None, max_in_flight: int = 64, initializer=None):
+
+        if kind not in ('thread', 'process'):
+            raise ValueError(f"Unknown executor kind {kind!r}; expected 'thread' or 'process'")
+
+        self.kind = kind
+        self.max_workers = max_workers
+        self.max_in_flight = max_in_flight
+        self.initializer = initializer
+        self.executor = None  # created by `start` or on first use, not when process workers import the server module
+
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected = 0
+
+    @contextmanager
+    def admit(self):
+        """
+        Reserve one of the in-flight slots for the duration of a request (raises Overloaded if there are none left).
+        """
+
+        if self.in_flight >= self.max_in_flight:
+            self.rejected += 1
+            raise Overloaded(f'{self.in_flight} requests already in flight')
+
+        self.in_flight += 1
+        self.admitted += 1
+
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+
+    def _create_executor(self):
+
+        if self.kind == 'thread':
+            return ThreadPoolExecutor(self.max_workers)
+
+        # spawn rather than fork, so that the workers don't inherit the server's threads and listening socket
+        return ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context('spawn'),
+                                   initializer=self.initializer)
+
+    async def start(self):
+        """
+        Create the pool and, for a process pool, start all of its workers, so that the first requests don't wait for
+        them to spawn (and run `initializer`).
+        """
+
+        if self.executor is None:
+            self.executor = self._create_executor()
+
+        if self.kind == 'process':
+            # every task submitted while no worker is idle starts a new one, up to the size of the pool
+            loop = asyncio.get_running_loop()
+            num_workers = self.max_workers or os.cpu_count()
+            await asyncio.gather(*(loop.run_in_executor(self.executor, _worker_started) for _ in range(num_workers)))
+
+    async def run(self, fn, *args):
+        """
+        Run `fn(*args)` on the pool and wait for its result without blocking the event loop.
+        """
+
+        if self.executor is None:
+            self.executor = self._create_executor()
+
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+
+    def stats(self) -> dict:
+        return {'executor': self.kind,
+                'max_in_flight': self.max_in_flight,
+                'in_flight': self.in_flight,
+                'admitted': self.admitted,
+                'rejected': self.rejected}
@@ -0,0 +1,124 @@
+import time
+import asyncio
+from typing import Callable
+
+
+class MicroBatcher:
+    """
+    Groups concurrent single predictions into batches.
+
+    Each call to `predict` puts its input in a queue and waits on a future. A collector task takes inputs off the queue
+    until `max_batch_size` of them are collected or `max_wait_ms` have passed since the first one, scores them with a
+    single call to `predict_batch` and resolves the futures with the results. When an executor is given, batches are
+    scored on it, so the next batch is collected while the previous ones are being scored.
+    """
+
+    def __init__(self, predict_batch: Callable[[list], list], max_batch_size: int = 32, max_wait_ms: float = 2.,
+                 executor=None):
+        self.predict_batch = predict_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.executor = executor  # InferenceExecutor to score batches on; in the event loop if None
+
+        self._queue = None
+        self._collector = None
+        self._flushes = set()
+
+        self.batches = 0
+        self.requests = 0
+        self.total_queue_delay = 0.
+        self.max_queue_delay = 0.
+
+    async def predict(self, data):
+        """
+        Score a single input as part of the next batch.
+        """
+
+        if self._collector is None or self._collector.done():  # started lazily, in the server's event loop
+            self._queue = asyncio.Queue()
+            self._collector = asyncio.create_task(self._collect())
+
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((data, future, time.perf_counter()))
+
+        return await future
+
+    async def _collect(self):
+
+        loop = asyncio.get_running_loop()
+
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+
+            while len(batch) < self.max_batch_size:
+                if not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                    continue
+
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            flush = asyncio.create_task(self._flush(batch))
+            self._flushes.add(flush)  # keep a reference until it's done
+            flush.add_done_callback(self._flushes.discard)
+
+    async def _predict_batch(self, data: list):
+
+        if self.executor is None:
+            return self.predict_batch(data)
+
+        return await self.executor.run(self.predict_batch, data)
+
+    async def _flush(self, batch: list):
+
+        now = time.perf_counter()
+        batch = [(data, future, enqueued) for data, future, enqueued in batch if not future.done()]  # e.g. cancelled
+
+        if not batch:
+            return
+
+        self.batches += 1
+        self.requests += len(batch)
+        for _, _, enqueued in batch:
+            self.total_queue_delay += now - enqueued
+            self.max_queue_delay = max(self.max_queue_delay, now - enqueued)
+
+        try:
+            results = await self._predict_batch([data for data, _, _ in batch])
+        except Exception:
+            # score the inputs one by one, so that a bad input only fails its own request
+            for data, future, _ in batch:
+                try:
+                    result = (await self._predict_batch([data]))[0]
+                except Exception as e:
+                    if not future.done():
+                        future.set_exception(e)
+                else:
+                    if not future.done():
+                        future.set_result(result)
+            return
+
+        for (_, future, _), result in zip(batch, results):
+            if not future.done():  # the request may have been cancelled while its batch was being scored
+                future.set_result(result)
+
+    def stats(self) -> dict:
+        """
+        Batch fill and queueing delay of the batches scored so far.
+        """
+
+        mean_batch_size = self.requests / self.batches if self.batches else 0.
+
+        return {'batches': self.batches,
+                'requests': self.requests,
+                'mean_batch_size': round(mean_batch_size, 2),
+                'mean_batch_fill': round(mean_batch_size / self.max_batch_size, 3),
+                'mean_queue_delay_ms': round(self.total_queue_delay / self.requests * 1000, 3) if self.requests else 0.,
+                'max_queue_delay_ms': round(self.max_queue_delay * 1000, 3)}
@@ -0,0 +1,170 @@
+import os
+import time
+import hashlib
+import threading
+import joblib
+from typing import List
+
+from src.serving_utils import CarData, preprocess_car_batch
+from src.compile_model import compile_pipeline, check_equivalence, category_sample, UnsupportedPipelineError
+
+
+class LoadedModel:
+    """
+    A loaded version of the model: the sklearn pipeline and, if it could be compiled, its lookup-table equivalent.
+    """
+
+    def __init__(self, pipeline, compiled, version: str):
+        self.pipeline = pipeline
+        self.compiled = compiled
+        self.version = version
+        self.loaded_at = time.time()
+
+    def predict_batch(self, data: List[CarData]):
+
+        if self.compiled is not None:
+            return self.compiled.predict_batch(data)
+
+        return self.pipeline.predict(preprocess_car_batch(data))
+
+
+def file_version(path: str) -> str:
+    """
+    Version of a model file: the first characters of its sha256.
+    """
+
+    sha256 = hashlib.sha256()
+
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(2 ** 20), b''):
+            sha256.update(chunk)
+
+    return sha256.hexdigest()[:12]
+
+
+def load_model(model_path: str, mmap_mode: str = 'r') -> LoadedModel:
+    """
+    Load the pipeline and compile it. The compiled model is checked against the pipeline on a sample of every known
+    category (see compile_model.py for a check on the training data); if they differ, the pipeline is served.
+
+    With `mmap_mode`, the pipeline's numpy arrays are memory-mapped from the file instead of copied to the heap, so
+    the workers serving the same model file share them. The file must then be replaced (not overwritten in place) when
+    a new model is saved, as train.py does.
+    """
+
+    version = file_version(model_path)
+    pipeline = joblib.load(model_path, mmap_mode=mmap_mode)
+
+    try:
+        compiled = compile_pipeline(pipeline)
+        check_equivalence(pipeline, compiled, category_sample(pipeline))
+    except UnsupportedPipelineError:  # served by the pipeline itself
+        compiled = None
+    except AssertionError as e:
+        print(f'Warning: not serving the compiled version of model {version}: {e}')
+        compiled = None
+
+    return LoadedModel(pipeline, compiled, version)
+
+
+class ModelManager:
+    """
+    Serves the latest version of a model file, reloading it when the file changes.
+
+    New versions are loaded in the background (`start` launches a thread that polls the file every `poll_interval`
+    seconds) and then swapped in with a single assignment to `current`. Requests that read `current` before the swap
+    finish with the previous version. If a new version fails to load (e.g. the file is still being written), the
+    current one keeps being served and the load is retried on the next poll.
+
+    :param model_path: path of the joblib model file
+    :param poll_interval: seconds between checks of the model file
+    :param mmap_mode: joblib `mmap_mode` for loading the model (None to load it in memory)
+    """
+
+    def __init__(self, model_path: str, poll_interval: float = 5., mmap_mode: str = 'r'):
+        self.model_path = model_path
+        self.poll_interval = poll_interval
+        self.mmap_mode = mmap_mode
+
+        self._signature = self._file_signature()
+        self.current = load_model(model_path, mmap_mode)
+
+        self.reloads = 0
+        self.last_error = None
+        self._last_poll = time.monotonic()
+        self._stop = threading.Event()
+        self._watcher = None
+
+    def _file_signature(self):
+        try:
+            stat = os.stat(self.model_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    @property
+    def watching(self) -> bool:
+        return self._watcher is not None and self._watcher.is_alive()
+
+    def poll(self) -> LoadedModel:
+        """
+        Reload the model if its file has changed since the last load; returns the current model.
+        """
+
+        self._last_poll = time.monotonic()
+
+        signature = self._file_signature()
+        if signature is None or signature == self._signature:
+            return self.current
+
+        try:
+            model = load_model(self.model_path, self.mmap_mode)
+        except Exception as e:
+            self.last_error = repr(e)
+            print(f'Failed to load new model from {self.model_path}, keeping version {self.current.version}: {e!r}')
+            return self.current
+
+        self._signature = signature
+        self.last_error = None
+
+        if model.version != self.current.version:  # e.g. not just touched
+            self.current = model
+            self.reloads += 1
+            print(f'Loaded model version {model.version}')
+
+        return self.current
+
+    def poll_if_due(self) -> LoadedModel:
+        """
+        Poll the model file if `poll_interval` seconds have passed since the last check (for processes that don't
+        run the background watcher).
+        """
+
+        if time.monotonic() - self._last_poll >= self.poll_interval:
+            return self.poll()
+
+        return self.current
+
+    def _watch(self):
+        while not self._stop.wait(self.poll_interval):
+            self.poll()
+
+    def start(self):
+        """
+        Start polling the model file in a background thread.
+        """
+
+        if not self.watching:
+            self._stop.clear()
+            self._watcher = threading.Thread(target=self._watch, daemon=True)
+            self._watcher.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def info(self) -> dict:
+        return {'version': self.current.version,
+                'compiled': self.current.compiled is not None,
+                'loaded_at': self.current.loaded_at,
+                'reloads': self.reloads,
+                'last_error': self.last_error}
@@ -0,0 +1,92 @@
+import time
+from collections import OrderedDict
+
+from src.serving_utils import CarData, FEATURE_NAMES
+
+
+def cache_key(data: CarData) -> tuple:
+    """
+    The car's fields in a fixed order, as validated (i.e. type-coerced) by pydantic.
+    """
+
+    return tuple(getattr(data, feature) for feature in FEATURE_NAMES)
+
+
+class PredictionCache:
+    """
+    LRU cache of predictions with a time-to-live, which is cleared when a new version of the model is served.
+
+    :param max_size: maximum number of cached predictions; least recently used ones are evicted first
+    :param ttl: seconds after which a cached prediction expires
+    """
+
+    def __init__(self, max_size: int = 10_000, ttl: float = 3600.):
+        self.max_size = max_size
+        self.ttl = ttl
+
+        self._entries = OrderedDict()  # key -> (prediction, time it was cached)
+        self.model_version = None  # version of the model that made the cached predictions
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, data: CarData, model_version: str):
+        """
+        Cached prediction of the given model version for the car, or None.
+        """
+
+        if model_version != self.model_version:
+            if self.model_version is not None:
+                self.invalidations += 1
+            self.clear()
+            self.model_version = model_version
+
+        key = cache_key(data)
+        entry = self._entries.get(key)
+
+        if entry is not None and time.monotonic() - entry[1] > self.ttl:
+            del self._entries[key]
+            self.expirations += 1
+            entry = None
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+
+        return entry[0]
+
+    def put(self, data: CarData, prediction: float, model_version: str):
+
+        if model_version != self.model_version:  # made by a model that is no longer (or not yet) served
+            return
+
+        key = cache_key(data)
+
+        self._entries[key] = (prediction, time.monotonic())
+        self._entries.move_to_end(key)
+
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+
+        lookups = self.hits + self.misses
+
+        return {'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations}
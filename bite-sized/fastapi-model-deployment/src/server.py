@@ -1,13 +1,80 @@
-from fastapi import FastAPI
-import joblib
+from fastapi import FastAPI, HTTPException
+from contextlib import asynccontextmanager
+from typing import List, Tuple
+import os
 
-from src.serving_utils import preprocess_car_request, CarData
+from src.serving_utils import CarData
+from src.model_manager import ModelManager, LoadedModel
+from src.micro_batching import MicroBatcher
+from src.inference_executor import InferenceExecutor, Overloaded
+from src.prediction_cache import PredictionCache
 
 MODEL_PATH = 'models/linear_regression_pipeline.pkl'
+MODEL_POLL_INTERVAL = float(os.environ.get('MODEL_POLL_INTERVAL', 5))  # seconds between checks for a new model
+MODEL_MMAP_MODE = os.environ.get('MODEL_MMAP_MODE', 'r') or None  # empty to load the model's arrays in memory
+MICRO_BATCHING = os.environ.get('MICRO_BATCHING', '0') == '1'  # group concurrent /predict calls into batches
+MICRO_BATCH_SIZE = int(os.environ.get('MICRO_BATCH_SIZE', 32))
+MICRO_BATCH_WAIT_MS = float(os.environ.get('MICRO_BATCH_WAIT_MS', 2))
+INFERENCE_EXECUTOR = os.environ.get('INFERENCE_EXECUTOR', 'thread')  # 'thread' or 'process'
+INFERENCE_WORKERS = int(os.environ['INFERENCE_WORKERS']) if 'INFERENCE_WORKERS' in os.environ else None
+MAX_IN_FLIGHT = int(os.environ.get('MAX_IN_FLIGHT', 64))  # requests over this limit get a 503
+PREDICTION_CACHE_SIZE = int(os.environ.get('PREDICTION_CACHE_SIZE', 10_000))  # 0 to disable the cache
+PREDICTION_CACHE_TTL = float(os.environ.get('PREDICTION_CACHE_TTL', 3600))  # seconds
 
-app = FastAPI()
+# the model is reloaded in the background whenever train.py saves a new version
+models = ModelManager(MODEL_PATH, MODEL_POLL_INTERVAL, MODEL_MMAP_MODE)
 
-model = joblib.load(MODEL_PATH)
+
+def current_model() -> LoadedModel:
+
+    if models.watching:
+        return models.current
+
+    # process workers don't run the background watcher, so they check the model file themselves
+    return models.poll_if_due()
+
+
+def predict_cars(data: List[CarData]) -> Tuple[List[float], str]:
+    """
+    Score a list of cars with a single model call; returns the predictions and the version of the model.
+    """
+
+    model = current_model()  # the same version is used for the whole call, even if a new one is swapped in meanwhile
+
+    return model.predict_batch(data).tolist(), model.version
+
+
+def predict_cars_versioned(data: List[CarData]) -> List[Tuple[float, str]]:
+
+    predictions, version = predict_cars(data)
+
+    return [(prediction, version) for prediction in predictions]
+
+
+# process workers load the model (by importing this module) when they start
+inference = InferenceExecutor(INFERENCE_EXECUTOR, INFERENCE_WORKERS, MAX_IN_FLIGHT, initializer=current_model)
+
+batcher = None
+if MICRO_BATCHING:
+    batcher = MicroBatcher(predict_cars_versioned, MICRO_BATCH_SIZE, MICRO_BATCH_WAIT_MS, inference)
+
+cache = PredictionCache(PREDICTION_CACHE_SIZE, PREDICTION_CACHE_TTL) if PREDICTION_CACHE_SIZE > 0 else None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    models.start()
+    await inference.start()  # so that the first requests don't wait for the workers to spawn
+    yield
+    models.stop()
+    inference.shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+def overloaded() -> HTTPException:
+    return HTTPException(status_code=503, detail='Server overloaded, retry later', headers={'Retry-After': '1'})
 
 
 @app.get('/')
@@ -15,14 +82,85 @@ async def root() -> dict:
     return {'message': 'Hello World'}
 
 
+@app.get('/model')
+async def model_info() -> dict:
+    """
+    Version of the model being served.
+    """
+
+    return models.info()
+
+
+@app.get('/stats')
+async def stats() -> dict:
+    """
+    Requests in flight and rejected, prediction cache hits/misses/evictions, and batch fill and queueing delay of the
+    micro-batched /predict calls.
+    """
+
+    return {'inference': inference.stats(),
+            'prediction_cache': cache.stats() if cache is not None else None,
+            'micro_batching': batcher.stats() if batcher is not None else None}
+
+
 @app.post('/predict')
 async def score(data: CarData) -> dict:
     """
     Main prediction endpoint.
     """
 
-    preprocessed_data = preprocess_car_request(data)
+    version = models.current.version
+    prediction = cache.get(data, version) if cache is not None else None
+
+    if prediction is None:
+        try:
+            with inference.admit():
+                if batcher is not None:
+                    prediction, version = await batcher.predict(data)
+                else:
+                    predictions, version = await inference.run(predict_cars, [data])
+                    prediction = predictions[0]
+        except Overloaded:
+            raise overloaded() from None
+
+        if cache is not None:
+            cache.put(data, prediction, version)
+
+    return {'predictions': str(prediction), 'model_version': version}
+
+
+@app.post('/predict/batch')
+async def score_batch(data: List[CarData]) -> dict:
+    """
+    Batch prediction endpoint: scores a list of cars with a single model call.
+    """
+
+    version = models.current.version
+
+    if not data:
+        return {'predictions': [], 'model_version': version}
+
+    preds = [cache.get(car, version) if cache is not None else None for car in data]
+    missing = [i for i, pred in enumerate(preds) if pred is None]  # only these need to be scored
+
+    if missing:
+        try:
+            with inference.admit():
+                scored, scored_version = await inference.run(predict_cars, [data[i] for i in missing])
+
+                if scored_version != version and len(missing) < len(data):
+                    # a new model was swapped in meanwhile: score the cached cars with it too, so that the response
+                    # doesn't mix predictions of different versions
+                    missing = list(range(len(data)))
+                    scored, scored_version = await inference.run(predict_cars, data)
+        except Overloaded:
+            raise overloaded() from None
+
+        version = scored_version
 
-    preds = model.predict(preprocessed_data)
+        for i, pred in zip(missing, scored):
+            preds[i] = pred
+            if cache is not None:
+                cache.put(data[i], pred, version)
 
-    return {'predictions': str(preds[0])}
+    return {'predictions': preds, 'model_version': version}
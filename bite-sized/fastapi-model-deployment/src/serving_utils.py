@@ -12,20 +12,24 @@ class CarData(BaseModel):
     Owner_Type: str
 
 
+FEATURE_NAMES = ['Location', 'Year', 'Kilometers_Driven', 'Fuel_Type', 'Transmission', 'Owner_Type']
+
+
 def preprocess_car_request(data: CarData):
     """
     Preprocess the car request data before making predictions.
     """
 
-    fields = [
-        data.Location,
-        data.Year,
-        data.Kilometers_Driven,
-        data.Fuel_Type,
-        data.Transmission,
-        data.Owner_Type,
-    ]
+    return preprocess_car_batch([data])
+
+
+def preprocess_car_batch(data: List[CarData]):
+    """
+    Preprocess a list of car requests into a single DataFrame (one row per car), so they can be scored with a single
+    model call.
+    """
 
-    feature_names = ['Location', 'Year', 'Kilometers_Driven', 'Fuel_Type', 'Transmission', 'Owner_Type']
+    rows = [[car.Location, car.Year, car.Kilometers_Driven, car.Fuel_Type, car.Transmission, car.Owner_Type]
+            for car in data]
 
-    return pd.DataFrame([fields], columns=feature_names).fillna(0)
+    return pd.DataFrame(rows, columns=FEATURE_NAMES).fillna(0)
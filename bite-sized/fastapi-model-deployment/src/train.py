@@ -3,6 +3,7 @@ from sklearn.linear_model import LinearRegression
 from sklearn.preprocessing import OneHotEncoder, StandardScaler
 from sklearn.pipeline import Pipeline
 import joblib
+import os
 
 dataset_path = 'data/car_price_prediction.csv'
 model_output_path = 'models/linear_regression_pipeline.pkl'
@@ -20,4 +21,7 @@ pipe = Pipeline([('encoder', OneHotEncoder()),
 
 pipe.fit(X, y)
 
-joblib.dump(pipe, model_output_path)
+# write to a temporary file and then replace the model, so that servers never load (or have memory-mapped) a
+# partially written file
+joblib.dump(pipe, model_output_path + '.tmp')
+os.replace(model_output_path + '.tmp', model_output_path)
@@ -0,0 +1,33 @@
+import joblib
+import pandas as pd
+import pytest
+from sklearn.linear_model import LinearRegression
+from sklearn.preprocessing import OneHotEncoder, StandardScaler
+from sklearn.pipeline import Pipeline
+
+from src.compile_model import DATASET_PATH, load_training_features
+
+
+@pytest.fixture(scope='session')
+def pipeline():
+    """
+    A pipeline trained the way train.py does, so that the tests don't depend on a previously saved model.
+    """
+
+    pipe = Pipeline([('encoder', OneHotEncoder()),
+                     ('scaler', StandardScaler(with_mean=False)),
+                     ('regressor', LinearRegression())])
+
+    return pipe.fit(load_training_features(), pd.read_csv(DATASET_PATH, index_col=0)['Price'])
+
+
+@pytest.fixture
+def model_path(tmp_path, pipeline) -> str:
+    """
+    The trained pipeline, saved in a temporary model file.
+    """
+
+    path = str(tmp_path / 'model.pkl')
+    joblib.dump(pipeline, path)
+
+    return path
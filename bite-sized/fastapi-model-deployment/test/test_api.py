@@ -15,4 +15,24 @@ def test_predict():
 
     r = requests.post('http://localhost:8000/predict', json=payload)
 
-    assert float(r.json()['predictions']) > 0
\ No newline at end of file
+    assert float(r.json()['predictions']) > 0
+
+
+def test_predict_batch():
+
+    payload = [{'Location': 'Hyderabad', 'Year': 2008, 'Kilometers_Driven': 90000, 'Fuel_Type': 'Diesel',
+                'Transmission': 'Manual', 'Owner_Type': 'Second'},
+               {'Location': 'Mumbai', 'Year': 2015, 'Kilometers_Driven': 30000, 'Fuel_Type': 'Petrol',
+                'Transmission': 'Automatic', 'Owner_Type': 'First'}]
+
+    r = requests.post('http://localhost:8000/predict/batch', json=payload)
+
+    predictions = r.json()['predictions']
+
+    assert len(predictions) == 2
+    assert all(isinstance(p, float) for p in predictions)
+
+    # same predictions as the single-car endpoint
+    for car, prediction in zip(payload, predictions):
+        single = requests.post('http://localhost:8000/predict', json=car)
+        assert abs(float(single.json()['predictions']) - prediction) < 1e-6
@@ -0,0 +1,63 @@
+import joblib
+import numpy as np
+import pytest
+from sklearn.base import clone
+
+from src.compile_model import compile_pipeline, load_training_features, UnsupportedPipelineError
+from src.model_manager import load_model
+from src.serving_utils import CarData
+
+
+def test_compiled_model_matches_pipeline(pipeline):
+
+    compiled = compile_pipeline(pipeline)
+
+    X = load_training_features()
+
+    assert np.allclose(compiled.predict(X), pipeline.predict(X))
+
+    car = CarData(**X.iloc[0].to_dict())
+
+    assert abs(compiled.predict_one(car) - pipeline.predict(X.iloc[:1])[0]) < 1e-6
+
+
+def test_unsupported_pipeline_is_served_uncompiled(pipeline, tmp_path):
+
+    X = load_training_features()
+
+    pipe = clone(pipeline).set_params(encoder__drop='first').fit(X, pipeline.predict(X))
+
+    with pytest.raises(UnsupportedPipelineError):
+        compile_pipeline(pipe)
+
+    model_path = str(tmp_path / 'model.pkl')
+    joblib.dump(pipe, model_path)
+    model = load_model(model_path)
+
+    car = CarData(**X.iloc[0].to_dict())
+
+    assert model.compiled is None
+    assert abs(model.predict_batch([car])[0] - pipe.predict(X.iloc[:1])[0]) < 1e-6
+
+
+def test_loads_without_training_data(model_path, monkeypatch, tmp_path):
+
+    monkeypatch.chdir(tmp_path)  # data/car_price_prediction.csv isn't deployed with the model
+
+    assert load_model(model_path).compiled is not None
+
+
+def test_mismatching_compiled_model_falls_back_to_pipeline(model_path, pipeline, monkeypatch):
+
+    def compile_wrong(pipe):
+        compiled = compile_pipeline(pipe)
+        compiled.intercept += 1
+        return compiled
+
+    monkeypatch.setattr('src.model_manager.compile_pipeline', compile_wrong)
+
+    model = load_model(model_path)
+    X = load_training_features()
+
+    assert model.compiled is None
+    assert abs(model.predict_batch([CarData(**X.iloc[0].to_dict())])[0] - pipeline.predict(X.iloc[:1])[0]) < 1e-6
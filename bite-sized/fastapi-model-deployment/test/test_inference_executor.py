@@ -0,0 +1,65 @@
+import time
+import asyncio
+import pytest
+
+from src.inference_executor import InferenceExecutor, Overloaded
+
+
+def test_requests_over_the_limit_are_rejected():
+
+    inference = InferenceExecutor('thread', max_workers=2, max_in_flight=2)
+
+    async def request():
+        with inference.admit():
+            return await inference.run(time.sleep, 0.1)
+
+    async def run():
+        return await asyncio.gather(*[request() for _ in range(5)], return_exceptions=True)
+
+    results = asyncio.run(run())
+    inference.shutdown()
+
+    assert sum(isinstance(result, Overloaded) for result in results) == 3
+    assert inference.stats()['in_flight'] == 0
+
+
+def test_inference_does_not_block_the_event_loop():
+
+    inference = InferenceExecutor('thread')
+
+    async def run():
+        slow = asyncio.ensure_future(inference.run(time.sleep, 0.2))
+        start = time.perf_counter()
+        await asyncio.sleep(0.01)  # would only return after the sleep if it ran on the event loop
+        elapsed = time.perf_counter() - start
+        await slow
+        return elapsed
+
+    assert asyncio.run(run()) < 0.1
+    inference.shutdown()
+
+
+def test_unknown_executor_kind():
+
+    with pytest.raises(ValueError):
+        InferenceExecutor('gpu')
+
+
+def test_start_spawns_all_process_workers():
+
+    inference = InferenceExecutor('process', max_workers=2)
+
+    async def run():
+        await inference.start()
+        num_processes = len(inference.executor._processes)
+
+        start = time.perf_counter()
+        await inference.run(abs, -1)  # no worker left to spawn
+
+        return num_processes, time.perf_counter() - start
+
+    num_processes, elapsed = asyncio.run(run())
+    inference.shutdown()
+
+    assert num_processes == 2
+    assert elapsed < 0.5
@@ -0,0 +1,39 @@
+import asyncio
+
+from src.micro_batching import MicroBatcher
+
+
+def test_concurrent_predictions_are_batched():
+
+    batches = []
+
+    def predict_batch(data):
+        batches.append(list(data))
+        return [2 * x for x in data]
+
+    async def run():
+        batcher = MicroBatcher(predict_batch, max_batch_size=4, max_wait_ms=50)
+        return batcher, await asyncio.gather(*[batcher.predict(x) for x in range(10)])
+
+    batcher, results = asyncio.run(run())
+
+    assert results == [2 * x for x in range(10)]
+    assert [len(batch) for batch in batches] == [4, 4, 2]
+    assert batcher.stats()['requests'] == 10
+
+
+def test_bad_input_only_fails_its_own_request():
+
+    def predict_batch(data):
+        if 'bad' in data:
+            raise ValueError('unknown category')
+        return [x.upper() for x in data]
+
+    async def run():
+        batcher = MicroBatcher(predict_batch, max_batch_size=8, max_wait_ms=10)
+        return await asyncio.gather(*[batcher.predict(x) for x in ['a', 'bad', 'b']], return_exceptions=True)
+
+    a, bad, b = asyncio.run(run())
+
+    assert (a, b) == ('A', 'B')
+    assert isinstance(bad, ValueError)
@@ -0,0 +1,41 @@
+import copy
+import shutil
+import joblib
+
+from src.model_manager import ModelManager
+from src.serving_utils import CarData
+
+
+def test_reloads_new_model_versions(model_path, pipeline):
+
+    models = ModelManager(model_path, poll_interval=0)
+    old = models.current
+
+    car = CarData(Location='Hyderabad', Year=2008, Kilometers_Driven=90000, Fuel_Type='Diesel',
+                  Transmission='Manual', Owner_Type='Second')
+    old_prediction = old.predict_batch([car])[0]
+
+    # a new model (same pipeline, different intercept), saved the way train.py does
+    pipe = copy.deepcopy(pipeline)
+    pipe.named_steps['regressor'].intercept_ += 1
+    joblib.dump(pipe, model_path + '.tmp')
+    shutil.move(model_path + '.tmp', model_path)
+
+    new = models.poll()
+
+    assert new.version != old.version
+    assert abs(new.predict_batch([car])[0] - old_prediction - 1) < 1e-6
+    assert abs(old.predict_batch([car])[0] - old_prediction) < 1e-9  # requests holding the old version are unaffected
+    assert models.reloads == 1
+
+
+def test_keeps_serving_when_a_new_model_fails_to_load(model_path):
+
+    models = ModelManager(model_path, poll_interval=0)
+    version = models.current.version
+
+    with open(model_path, 'wb') as f:
+        f.write(b'not a model')
+
+    assert models.poll().version == version
+    assert models.last_error is not None
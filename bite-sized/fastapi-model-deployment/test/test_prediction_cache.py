@@ -0,0 +1,53 @@
+import time
+
+from src.prediction_cache import PredictionCache
+from src.serving_utils import CarData
+
+
+def car(year: int) -> CarData:
+    return CarData(Location='Hyderabad', Year=year, Kilometers_Driven=90000, Fuel_Type='Diesel',
+                   Transmission='Manual', Owner_Type='Second')
+
+
+def test_lru_eviction():
+
+    cache = PredictionCache(max_size=2)
+    cache.get(car(2008), 'v1')
+
+    cache.put(car(2008), 1., 'v1')
+    cache.put(car(2009), 2., 'v1')
+    assert cache.get(car(2008), 'v1') == 1.  # 2009 is now the least recently used
+
+    cache.put(car(2010), 3., 'v1')
+
+    assert cache.get(car(2009), 'v1') is None
+    assert cache.get(car(2010), 'v1') == 3.
+    assert cache.stats()['evictions'] == 1
+    assert (cache.hits, cache.misses) == (2, 2)
+
+
+def test_ttl():
+
+    cache = PredictionCache(ttl=0.05)
+    cache.get(car(2008), 'v1')
+
+    cache.put(car(2008), 1., 'v1')
+    time.sleep(0.1)
+
+    assert cache.get(car(2008), 'v1') is None
+    assert cache.expirations == 1
+
+
+def test_invalidated_when_the_model_changes():
+
+    cache = PredictionCache()
+    cache.get(car(2008), 'v1')
+
+    cache.put(car(2008), 1., 'v1')
+    assert cache.get(car(2008), 'v1') == 1.
+
+    assert cache.get(car(2008), 'v2') is None
+    assert cache.invalidations == 1
+
+    cache.put(car(2009), 2., 'v1')  # made by the previous model while the new one was being swapped in
+    assert cache.get(car(2009), 'v2') is None
@@ -0,0 +1,72 @@
+import time
+import threading
+
+
+class BackgroundEmbeddings:
+    """
+    Embeddings whose model is imported, loaded and warmed up in a background thread
+
+    Importing torch/sentence-transformers and loading the model take most of the startup time of the search service,
+    so they overlap with the rest of it (e.g. mapping the index in). Calls to `embed_documents`/`embed_query` block
+    until the model is ready.
+
+    :param model_name: name of the HuggingFace model
+    :param embeddings_class: langchain embeddings class; `HuggingFaceEmbeddings` (imported in the background) if None
+    :param warmup_text: text embedded once after loading, so the first query doesn't pay for lazy initializations
+    """
+
+    def __init__(self, model_name, embeddings_class=None, warmup_text='warm up'):
+        self.model_name = model_name
+        self.timings = {}
+        self._embeddings = None
+        self._error = None
+        self._ready = threading.Event()
+
+        threading.Thread(target=self._load, args=(embeddings_class, warmup_text), daemon=True).start()
+
+    def _load(self, embeddings_class, warmup_text):
+
+        try:
+            start = time.perf_counter()
+            if embeddings_class is None:
+                from langchain_huggingface import HuggingFaceEmbeddings  # slow: imports torch
+                embeddings_class = HuggingFaceEmbeddings
+            self.timings['model_import_sec'] = round(time.perf_counter() - start, 3)
+
+            start = time.perf_counter()
+            embeddings = embeddings_class(model_name=self.model_name)
+            self.timings['model_load_sec'] = round(time.perf_counter() - start, 3)
+
+            start = time.perf_counter()
+            embeddings.embed_documents([warmup_text])
+            self.timings['model_warmup_sec'] = round(time.perf_counter() - start, 3)
+
+            self._embeddings = embeddings
+
+        except Exception as e:
+            self._error = e
+
+        finally:
+            self._ready.set()
+
+    def is_ready(self):
+        return self._ready.is_set() and self._error is None
+
+    def wait(self, timeout=None):
+        """
+        Wait for the model to be loaded and return the underlying embeddings
+        """
+
+        if not self._ready.wait(timeout):
+            raise TimeoutError(f'Embedding model {self.model_name} is still loading')
+
+        if self._error is not None:
+            raise RuntimeError(f'Failed to load embedding model {self.model_name}') from self._error
+
+        return self._embeddings
+
+    def embed_documents(self, texts):
+        return self.wait().embed_documents(texts)
+
+    def embed_query(self, text):
+        return self.wait().embed_query(text)
@@ -0,0 +1,127 @@
+import json
+import time
+import faiss
+import argparse
+import numpy as np
+from langchain_huggingface import HuggingFaceEmbeddings
+
+from benchmark_index import benchmark_index
+from populate_movie_faiss import load_and_preprocess_movie_data_cached, projected_index_spec
+
+
+def split_corpus(movies, corpus_size=10_000, num_queries=500, seed=0):
+    """
+    Sample the summaries to index and hold out other movies, whose first sentence is used as a query
+    """
+
+    rng = np.random.default_rng(seed)
+    sample = rng.choice(len(movies), size=min(corpus_size + num_queries, len(movies)), replace=False)
+
+    summaries = movies['plot_summary'].iloc[sample].tolist()
+
+    return summaries[num_queries:], [summary.split('. ')[0] for summary in summaries[:num_queries]]
+
+
+def embed(texts, embeddings, batch_size=256):
+    """
+    Embed texts in batches; returns the (float32) vectors and the throughput in docs/sec
+    """
+
+    start = time.perf_counter()
+
+    vectors = np.vstack([np.array(embeddings.embed_documents(texts[i:i + batch_size]), dtype=np.float32)
+                         for i in range(0, len(texts), batch_size)])
+
+    return vectors, len(texts) / (time.perf_counter() - start)
+
+
+def evaluate_projection(database, queries, ground_truth, projection=None, index_spec='Flat', k=10,
+                        train_size=50_000):
+    """
+    Index the vectors with an (optionally projected) index and measure its size, latency and recall@k against the
+    baseline's neighbors (see benchmark_index.py)
+    """
+
+    result = benchmark_index(projected_index_spec(index_spec, projection), database, queries, ground_truth, k=k,
+                             train_size=train_size)
+
+    return {'projection': projection or 'none',
+            'stored_dim': result['stored_dim'],
+            'index_mb': result['memory_mb'],
+            f'recall@{k}': result[f'recall@{k}'],
+            'p50_ms': result['p50_ms']}
+
+
+def run_report(texts, query_texts, model_names, projections=(None,), index_spec='Flat', k=10, train_size=50_000,
+               embeddings_class=HuggingFaceEmbeddings):
+    """
+    Compare embedding models and projections on the same corpus and queries
+
+    The baseline is the first model without projection, searched exactly: recall@k is the fraction of its k nearest
+    neighbors that each configuration retrieves for the same query texts.
+    """
+
+    results, ground_truth = [], None
+
+    for model_name in model_names:
+
+        embeddings = embeddings_class(model_name=model_name)
+
+        database, docs_per_sec = embed(texts, embeddings)
+        queries, _ = embed(query_texts, embeddings)
+
+        if ground_truth is None:
+            exact = faiss.IndexFlatL2(database.shape[1])
+            exact.add(database)
+            _, ground_truth = exact.search(queries, k)
+
+        for projection in projections:
+            result = evaluate_projection(database, queries, ground_truth, projection=projection,
+                                         index_spec=index_spec, k=k, train_size=train_size)
+            results.append({'model': model_name, 'model_dim': database.shape[1],
+                            'embed_docs_per_sec': round(docs_per_sec, 1), **result})
+
+    return results
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--models', type=str, nargs='+', required=False,
+                        default=['sentence-transformers/all-mpnet-base-v2',
+                                 'sentence-transformers/all-MiniLM-L12-v2',
+                                 'sentence-transformers/all-MiniLM-L6-v2'],
+                        help='Embedding models to compare; the first one (without projection) is the baseline')
+    parser.add_argument('--projections', type=str, nargs='+', required=False,
+                        default=['none', 'PCA256', 'PCA128', 'OPQ16_128'],
+                        help="Projections to compare for every model ('none' for the raw embeddings)")
+    parser.add_argument('--index-spec', type=str, required=False, default='Flat',
+                        help='FAISS index factory spec the projections are applied to')
+    parser.add_argument('--corpus-size', type=int, required=False, default=10_000,
+                        help='Number of movie summaries embedded and indexed')
+    parser.add_argument('--num-queries', type=int, required=False, default=500,
+                        help='Number of held-out movies whose first summary sentence is used as a query')
+    parser.add_argument('--k', type=int, required=False, default=10,
+                        help='Number of neighbors retrieved per query (the k of recall@k)')
+    parser.add_argument('--train-size', type=int, required=False, default=50_000,
+                        help='Number of vectors used to train the projections (and IVF/PQ indexes)')
+    parser.add_argument('--output', type=str, required=False, default=None,
+                        help='Optionally write the results to a JSON file')
+
+    args = parser.parse_args()
+
+    texts, query_texts = split_corpus(load_and_preprocess_movie_data_cached(), corpus_size=args.corpus_size,
+                                      num_queries=args.num_queries)
+    print(f'Comparing on {len(texts)} summaries and {len(query_texts)} held-out queries')
+
+    results = run_report(texts, query_texts, args.models,
+                         projections=[None if projection == 'none' else projection for projection in args.projections],
+                         index_spec=args.index_spec, k=args.k, train_size=args.train_size)
+
+    for result in results:
+        print(' | '.join(f'{key}: {value}' for key, value in result.items()))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,148 @@
+import os
+import json
+import time
+import faiss
+import argparse
+import numpy as np
+
+from populate_movie_faiss import build_index
+from search_params import set_search_params
+
+
+def load_vectors(index_dir='movie_faiss'):
+    """
+    Load all vectors stored in a saved (flat) FAISS index
+    """
+
+    index = faiss.read_index(os.path.join(index_dir, 'index.faiss'))
+
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def split_queries(vectors, num_queries=1000, seed=0):
+    """
+    Hold out a random sample of the vectors to be used as queries; the rest are the ones that will be indexed
+    """
+
+    rng = np.random.default_rng(seed)
+    is_query = np.zeros(len(vectors), dtype=bool)
+    is_query[rng.choice(len(vectors), size=min(num_queries, len(vectors) // 10), replace=False)] = True
+
+    return vectors[~is_query], vectors[is_query]
+
+
+def index_memory(index):
+    """
+    Size of an index in bytes (as serialized, i.e. roughly the memory it occupies)
+    """
+
+    return faiss.serialize_index(index).nbytes
+
+
+def recall_at_k(found, ground_truth):
+    """
+    Fraction of the true k nearest neighbors that were retrieved
+    """
+
+    return np.mean([len(set(f) & set(g)) / len(g) for f, g in zip(found, ground_truth)])
+
+
+def stored_dim(index):
+    """
+    Dimension of the vectors an index stores (lower than its input dimension if it starts with a projection)
+    """
+
+    index = faiss.downcast_index(index)
+
+    return index.index.d if isinstance(index, faiss.IndexPreTransform) else index.d
+
+
+def benchmark_index(index_spec, database, queries, ground_truth, k=10, train_size=50_000, nprobe=None,
+                    ef_search=None):
+    """
+    Build an index of a given spec over the database vectors and measure its recall@k (against the exact results),
+    single-query latency, memory and stored vector dimension
+    """
+
+    index = build_index(database.shape[1], index_spec)
+
+    start = time.perf_counter()
+    if not index.is_trained:
+        rng = np.random.default_rng(0)
+        index.train(database[rng.choice(len(database), size=min(train_size, len(database)), replace=False)])
+    index.add(database)
+    build_time = time.perf_counter() - start
+
+    set_search_params(index, nprobe=nprobe, ef_search=ef_search)
+
+    found, latencies = [], []
+
+    for query in queries:
+        start = time.perf_counter()
+        _, ids = index.search(query[None, :], k)
+        latencies.append(time.perf_counter() - start)
+        found.append(ids[0])
+
+    latencies = np.array(latencies) * 1000
+
+    return {'index_spec': index_spec,
+            f'recall@{k}': round(float(recall_at_k(found, ground_truth)), 4),
+            'p50_ms': round(float(np.percentile(latencies, 50)), 3),
+            'p99_ms': round(float(np.percentile(latencies, 99)), 3),
+            'memory_mb': round(index_memory(index) / 2 ** 20, 2),
+            'stored_dim': stored_dim(index),
+            'build_sec': round(build_time, 2)}
+
+
+def run_benchmark(vectors, index_specs, k=10, num_queries=1000, train_size=50_000, nprobe=None, ef_search=None):
+    """
+    Benchmark a list of index specs against exact search on the same vectors
+    """
+
+    database, queries = split_queries(vectors, num_queries=num_queries)
+
+    exact = faiss.IndexFlatL2(database.shape[1])
+    exact.add(database)
+    _, ground_truth = exact.search(queries, k)
+
+    return [benchmark_index(index_spec, database, queries, ground_truth, k=k, train_size=train_size,
+                            nprobe=nprobe, ef_search=ef_search)
+            for index_spec in index_specs]
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--index-dir', type=str, required=False, default='movie_faiss',
+                        help='Directory of a flat index built by populate_movie_faiss.py; its vectors are re-indexed')
+    parser.add_argument('--index-specs', type=str, nargs='+', required=False,
+                        default=['Flat', 'IVF1024,Flat', 'IVF1024,PQ64', 'HNSW32'],
+                        help='FAISS index factory specs to benchmark')
+    parser.add_argument('--k', type=int, required=False, default=10,
+                        help='Number of neighbors retrieved per query (the k of recall@k)')
+    parser.add_argument('--num-queries', type=int, required=False, default=1000,
+                        help='Number of vectors held out and used as queries')
+    parser.add_argument('--train-size', type=int, required=False, default=50_000,
+                        help='Number of vectors used to train IVF/PQ indexes')
+    parser.add_argument('--nprobe', type=int, required=False, default=16,
+                        help='Number of clusters visited per query by IVF indexes')
+    parser.add_argument('--ef-search', type=int, required=False, default=64,
+                        help='Size of the candidate list of HNSW indexes')
+    parser.add_argument('--output', type=str, required=False, default=None,
+                        help='Optionally write the results to a JSON file')
+
+    args = parser.parse_args()
+
+    vectors = load_vectors(args.index_dir)
+    print(f'Loaded {len(vectors)} vectors of dim {vectors.shape[1]} from {args.index_dir}')
+
+    results = run_benchmark(vectors, args.index_specs, k=args.k, num_queries=args.num_queries,
+                            train_size=args.train_size, nprobe=args.nprobe, ef_search=args.ef_search)
+
+    for result in results:
+        print(' | '.join(f'{key}: {value}' for key, value in result.items()))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
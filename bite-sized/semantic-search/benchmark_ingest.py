@@ -0,0 +1,200 @@
+import os
+import json
+import time
+import shutil
+import random
+import argparse
+import platform
+import subprocess
+import faiss
+import numpy as np
+import pandas as pd
+from contextlib import contextmanager
+from langchain_community.vectorstores import FAISS
+
+from populate_movie_faiss import (build_documents, compute_content_hashes, init_faiss, iter_movie_batches,
+                                  load_and_preprocess_characters, load_and_preprocess_metadata,
+                                  load_and_preprocess_summaries, merge_tables, movie_ids, save_vector_store,
+                                  train_index_on_sample)
+from synthetic_corpus import WORDS, StubEmbeddings, generate_movie_dataset
+
+
+class StageTimer:
+    """
+    Accumulates the wall-clock time spent in each named stage, e.g.:
+
+        with timer('embed'):
+            ...
+    """
+
+    def __init__(self):
+        self.seconds = {}
+
+    @contextmanager
+    def __call__(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[stage] = self.seconds.get(stage, 0.) + time.perf_counter() - start
+
+
+def git_commit():
+    """
+    Commit the benchmark runs on (if it runs from a git checkout), so that results can be compared across commits
+    """
+
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def directory_size(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def benchmark_ingest(movie_dataset_dir, save_dir, index_spec='Flat', dim=768, batch_size=500, train_size=50_000,
+                     num_queries=1000, k=4, seed=0):
+    """
+    Run the ingestion of `populate_movie_faiss.py` on a dataset, followed by searches on the saved index, and time
+    every stage: load, merge, build_documents, embed, add (plus train and hash), save, load_local and search
+
+    Embeddings come from `StubEmbeddings`, so the timings isolate the cost of everything but the model.
+    """
+
+    timer = StageTimer()
+
+    with timer('load'):
+        summaries = load_and_preprocess_summaries(movie_dataset_dir=movie_dataset_dir)
+        metadata = load_and_preprocess_metadata(movie_dataset_dir=movie_dataset_dir)
+        characters = load_and_preprocess_characters(movie_dataset_dir=movie_dataset_dir)
+
+    with timer('merge'):
+        movies = merge_tables(summaries, metadata, characters)
+
+    embeddings = StubEmbeddings(dim=dim)
+    vector_store = init_faiss(index_spec=index_spec, embeddings=embeddings)
+    content_hashes = {}
+
+    movie_batches = iter_movie_batches(movies, batch_size=batch_size)
+
+    if not vector_store.index.is_trained:
+        with timer('train'):
+            movie_batches = train_index_on_sample(movie_batches, vector_store, train_size=train_size)
+
+    for batch in movie_batches:
+
+        with timer('build_documents'):
+            documents = build_documents(batch)
+            texts = [doc.page_content for doc in documents]
+
+        with timer('embed'):
+            vectors = embeddings.embed_documents(texts)
+
+        with timer('add'):
+            vector_store.add_embeddings(zip(texts, vectors), metadatas=[doc.metadata for doc in documents],
+                                        ids=movie_ids(batch))
+
+        with timer('hash'):
+            content_hashes.update(compute_content_hashes(batch))
+
+    shutil.rmtree(save_dir, ignore_errors=True)
+
+    with timer('save'):
+        save_vector_store(vector_store, save_dir, content_hashes)
+
+    with timer('load_local'):
+        vector_store = FAISS.load_local(save_dir, embeddings, allow_dangerous_deserialization=True)
+
+    rng = random.Random(seed)
+    queries = [' '.join(rng.choices(WORDS, k=5)) for _ in range(num_queries)]
+    latencies = []
+
+    with timer('search'):
+        for query in queries:
+            start = time.perf_counter()
+            vector_store.similarity_search_with_score(query, k=k)
+            latencies.append(time.perf_counter() - start)
+
+    latencies = np.array(latencies) * 1000
+    ingest_sec = sum(timer.seconds.get(stage, 0.) for stage in ('build_documents', 'embed', 'add', 'hash'))
+
+    return {'num_movies': len(movies),
+            'index_spec': index_spec,
+            'dim': dim,
+            'batch_size': batch_size,
+            'stages_sec': {stage: round(seconds, 4) for stage, seconds in timer.seconds.items()},
+            'ingest_docs_per_sec': round(len(movies) / ingest_sec, 1) if ingest_sec else None,
+            'index_size_mb': round(directory_size(save_dir) / 2 ** 20, 2),
+            'search': {'num_queries': num_queries,
+                       'k': k,
+                       'p50_ms': round(float(np.percentile(latencies, 50)), 3) if num_queries else None,
+                       'p99_ms': round(float(np.percentile(latencies, 99)), 3) if num_queries else None,
+                       'qps': round(num_queries / timer.seconds['search'], 1) if num_queries else None}}
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--sizes', type=int, nargs='+', required=False, default=[10_000],
+                        help='Number of movies of the synthetic datasets to benchmark, e.g. 10000 100000 1000000')
+    parser.add_argument('--data-dir', type=str, required=False, default='benchmark_data',
+                        help='Directory where the synthetic datasets (reused across runs) and indexes are written')
+    parser.add_argument('--index-spec', type=str, required=False, default='Flat',
+                        help='FAISS index factory spec (see populate_movie_faiss.build_index)')
+    parser.add_argument('--dim', type=int, required=False, default=768,
+                        help='Dimension of the stub embeddings (768, like the default model)')
+    parser.add_argument('--batch-size', type=int, required=False, default=500,
+                        help='Number of movies embedded and added to the vector store at a time')
+    parser.add_argument('--train-size', type=int, required=False, default=50_000,
+                        help='Number of movies whose embeddings are used to train IVF/PQ indexes')
+    parser.add_argument('--num-queries', type=int, required=False, default=1000,
+                        help='Number of searches timed on the saved index')
+    parser.add_argument('--k', type=int, required=False, default=4,
+                        help='Number of results per search')
+    parser.add_argument('--seed', type=int, required=False, default=0,
+                        help='Random seed of the synthetic datasets and queries')
+    parser.add_argument('--output', type=str, required=False, default='ingest_benchmark.json',
+                        help='JSON file where the results are written')
+
+    args = parser.parse_args()
+
+    runs = []
+
+    for size in args.sizes:
+
+        movie_dataset_dir = os.path.join(args.data_dir, f'movies-{size}-seed{args.seed}')
+
+        generate_sec = None
+        if not os.path.isfile(os.path.join(movie_dataset_dir, 'character.metadata.tsv')):
+            print(f'Generating a synthetic dataset of {size} movies under {movie_dataset_dir}...')
+            start = time.perf_counter()
+            generate_movie_dataset(movie_dataset_dir + '.tmp', size, seed=args.seed)
+            os.replace(movie_dataset_dir + '.tmp', movie_dataset_dir)
+            generate_sec = round(time.perf_counter() - start, 2)
+
+        print(f'Benchmarking {size} movies...')
+        result = benchmark_ingest(movie_dataset_dir, os.path.join(args.data_dir, f'index-{size}'),
+                                  index_spec=args.index_spec, dim=args.dim, batch_size=args.batch_size,
+                                  train_size=args.train_size, num_queries=args.num_queries, k=args.k, seed=args.seed)
+        result['generate_sec'] = generate_sec
+        runs.append(result)
+
+        print(' |_', ' | '.join(f'{stage}: {seconds:.2f}s' for stage, seconds in result['stages_sec'].items()))
+        print(' |_', f"{result['ingest_docs_per_sec']} docs/sec | search p50: {result['search']['p50_ms']}ms | "
+                     f"p99: {result['search']['p99_ms']}ms")
+
+    results = {'commit': git_commit(),
+               'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+               'platform': platform.platform(),
+               'versions': {'python': platform.python_version(), 'faiss': faiss.__version__,
+                            'numpy': np.__version__, 'pandas': pd.__version__},
+               'runs': runs}
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    print('Results written to', args.output)
@@ -0,0 +1,138 @@
+import os
+import json
+import time
+import shutil
+import itertools
+from langchain_community.vectorstores import FAISS
+
+
+class IngestCheckpointer:
+    """
+    Periodically checkpoints a vector store that is being populated, so that an interrupted ingestion can resume
+
+    Every checkpoint is written in its own directory (index, docstore, content hashes and a progress manifest); only
+    once it is complete, the `LATEST` file is atomically switched to point to it and older checkpoints are removed.
+    A crash while checkpointing therefore always leaves the previous checkpoint intact.
+
+    :param checkpoint_dir: directory where the checkpoints are written
+    :param every_batches: checkpoint after this many batches (None to disable)
+    :param every_seconds: checkpoint when this many seconds have passed since the last checkpoint (None to disable)
+    :param config: settings that must match for a checkpoint to be resumed (e.g. the batch size and index spec)
+    :param on_save: called after every checkpoint (e.g. to save the embedding cache)
+    """
+
+    def __init__(self, checkpoint_dir, every_batches=None, every_seconds=None, config=None, on_save=None):
+        self.checkpoint_dir = checkpoint_dir
+        self.every_batches = every_batches
+        self.every_seconds = every_seconds
+        self.config = config or {}
+        self.on_save = on_save
+
+        self.batches_done = 0
+        self._batches_since_checkpoint = 0
+        self._last_checkpoint_time = time.monotonic()
+
+        os.makedirs(checkpoint_dir, exist_ok=True)
+
+    @property
+    def _latest_path(self):
+        return os.path.join(self.checkpoint_dir, 'LATEST')
+
+    def latest(self):
+        """
+        Directory of the latest complete checkpoint, or None
+        """
+
+        if not os.path.isfile(self._latest_path):
+            return None
+
+        with open(self._latest_path) as f:
+            return os.path.join(self.checkpoint_dir, f.read().strip())
+
+    def restore(self, embeddings):
+        """
+        Load the vector store and content hashes of the latest checkpoint (or None if there isn't one)
+        """
+
+        path = self.latest()
+
+        if path is None:
+            return None
+
+        with open(os.path.join(path, 'manifest.json')) as f:
+            manifest = json.load(f)
+
+        if manifest['config'] != self.config:
+            raise ValueError(f'Checkpoint under {path} was created with {manifest["config"]}, but the current '
+                             f'settings are {self.config}; remove it to start from scratch')
+
+        vector_store = FAISS.load_local(path, embeddings, allow_dangerous_deserialization=True)
+
+        with open(os.path.join(path, 'content_hashes.json')) as f:
+            content_hashes = json.load(f)
+
+        self.batches_done = manifest['batches_done']
+
+        return vector_store, content_hashes
+
+    def skip_done(self, movie_batches):
+        """
+        Skip the batches that were already ingested before the checkpoint that was restored
+        """
+
+        return itertools.islice(movie_batches, self.batches_done, None)
+
+    def save(self, vector_store, content_hashes):
+        """
+        Write a new checkpoint and make it the latest one
+        """
+
+        name = f'checkpoint-{self.batches_done:08d}'
+        path = os.path.join(self.checkpoint_dir, name)
+
+        shutil.rmtree(path, ignore_errors=True)  # leftover of a checkpoint that was interrupted
+        vector_store.save_local(path)
+
+        with open(os.path.join(path, 'content_hashes.json'), 'w') as f:
+            json.dump(content_hashes, f)
+
+        with open(os.path.join(path, 'manifest.json'), 'w') as f:
+            json.dump({'batches_done': self.batches_done, 'num_vectors': vector_store.index.ntotal,
+                       'config': self.config, 'created_at': time.time()}, f)
+
+        with open(self._latest_path + '.tmp', 'w') as f:
+            f.write(name)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self._latest_path + '.tmp', self._latest_path)
+
+        for old in os.listdir(self.checkpoint_dir):
+            if old.startswith('checkpoint-') and old != name:
+                shutil.rmtree(os.path.join(self.checkpoint_dir, old), ignore_errors=True)
+
+        if self.on_save is not None:
+            self.on_save()
+
+        self._batches_since_checkpoint = 0
+        self._last_checkpoint_time = time.monotonic()
+
+    def batch_done(self, vector_store, content_hashes):
+        """
+        Record that a batch was added to the vector store and checkpoint if it's time to
+        """
+
+        self.batches_done += 1
+        self._batches_since_checkpoint += 1
+
+        due_batches = self.every_batches and self._batches_since_checkpoint >= self.every_batches
+        due_seconds = self.every_seconds and time.monotonic() - self._last_checkpoint_time >= self.every_seconds
+
+        if due_batches or due_seconds:
+            self.save(vector_store, content_hashes)
+
+    def clear(self):
+        """
+        Remove all checkpoints (e.g. once the ingestion has completed)
+        """
+
+        shutil.rmtree(self.checkpoint_dir, ignore_errors=True)
@@ -0,0 +1,287 @@
+import math
+import numpy as np
+import pandas as pd
+from langchain_core.documents import Document
+from langchain_community.docstore.base import AddableMixin, Docstore
+
+
+class _Buffer:
+    """
+    Growable 1-d numpy array (amortized O(1) appends)
+    """
+
+    def __init__(self, dtype, capacity=1024):
+        self.data = np.empty(capacity, dtype=dtype)
+        self.size = 0
+
+    def append(self, value):
+        if self.size == len(self.data):
+            self.data = np.resize(self.data, 2 * len(self.data))
+        self.data[self.size] = value
+        self.size += 1
+
+    def __getitem__(self, i):
+        return self.data[i]
+
+    def __getstate__(self):
+        return {'data': self.data[:self.size].copy(), 'size': self.size}
+
+    def __setstate__(self, state):
+        self.data = state['data'] if len(state['data']) else np.empty(1024, dtype=state['data'].dtype)
+        self.size = state['size']
+
+
+class _StringColumn:
+    """
+    Strings concatenated in a single UTF-8 buffer, plus the offset where each one starts
+    """
+
+    def __init__(self):
+        self.data = bytearray()
+        self.offsets = _Buffer(np.int64)
+        self.offsets.append(0)
+
+    def accepts(self, value):
+        return isinstance(value, str)
+
+    def append(self, value):
+        self.data += value.encode('utf-8')
+        self.offsets.append(len(self.data))
+
+    def append_missing(self):
+        self.offsets.append(len(self.data))
+
+    def get(self, row):
+        return self.data[self.offsets[row]:self.offsets[row + 1]].decode('utf-8')
+
+
+class _NumberColumn:
+    """
+    Numbers stored in a contiguous numpy array
+    """
+
+    def __init__(self, dtype):
+        self.values = _Buffer(dtype)
+        self.is_int = np.issubdtype(dtype, np.integer)
+
+    def accepts(self, value):
+        if isinstance(value, bool):
+            return False
+        if self.is_int:
+            return isinstance(value, (int, np.integer))
+        return isinstance(value, (int, float, np.integer, np.floating))
+
+    def append(self, value):
+        self.values.append(value)
+
+    def append_missing(self):
+        self.values.append(0)
+
+    def get(self, row):
+        return self.values[row].item()
+
+
+class _ListColumn:
+    """
+    Lists of (hashable) values, dictionary-encoded: each distinct value is stored once in a vocabulary and every list
+    is a slice of a flat array of vocabulary codes
+    """
+
+    def __init__(self, as_array):
+        self.as_array = as_array  # whether the lists were numpy arrays (e.g. the actors) rather than python lists
+        self.vocabulary = []
+        self.codes = _Buffer(np.int32)
+        self.offsets = _Buffer(np.int64)
+        self.offsets.append(0)
+        self._code_of = {}
+
+    def accepts(self, value):
+        return isinstance(value, np.ndarray if self.as_array else list) and all(_is_hashable(v) for v in value)
+
+    def append(self, values):
+        for value in values:
+            code = self._code_of.get(value)
+            if code is None:
+                code = self._code_of[value] = len(self.vocabulary)
+                self.vocabulary.append(value)
+            self.codes.append(code)
+        self.offsets.append(self.codes.size)
+
+    def append_missing(self):
+        self.offsets.append(self.codes.size)
+
+    def get(self, row):
+        values = [self.vocabulary[code] for code in self.codes[self.offsets[row]:self.offsets[row + 1]]]
+        return np.array(values, dtype=object) if self.as_array else values
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_code_of']  # can be rebuilt from the vocabulary
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._code_of = {value: code for code, value in enumerate(self.vocabulary)}
+
+
+class _ObjectColumn:
+    """
+    Fallback for values that don't fit any of the compact columns: a plain python list
+    """
+
+    def __init__(self, values=()):
+        self.values = list(values)
+
+    def accepts(self, value):
+        return True
+
+    def append(self, value):
+        self.values.append(value)
+
+    def append_missing(self):
+        self.values.append(None)
+
+    def get(self, row):
+        return self.values[row]
+
+
+def _is_hashable(value):
+    try:
+        hash(value)
+        return True
+    except TypeError:
+        return False
+
+
+def _is_missing(value):
+    return value is None or (isinstance(value, (float, np.floating)) and math.isnan(value))
+
+
+def _new_column(value):
+    """
+    Pick the most compact column type for a value
+    """
+
+    if isinstance(value, pd.api.extensions.ExtensionArray):
+        value = np.asarray(value, dtype=object)
+
+    for column in (_StringColumn(), _NumberColumn(np.int64), _NumberColumn(np.float64),
+                   _ListColumn(as_array=True), _ListColumn(as_array=False)):
+        if column.accepts(value):
+            return column
+
+    return _ObjectColumn()
+
+
+class ColumnarDocstore(Docstore, AddableMixin):
+    """
+    Docstore that keeps the documents in a few contiguous columns instead of one python Document object per entry
+
+        - page contents and string metadata are concatenated in UTF-8 buffers
+        - numeric metadata lives in numpy arrays
+        - list metadata (e.g. actors, genres) is dictionary-encoded as int32 codes
+
+    Documents are only materialized when they're looked up (i.e. for the top-k hits of a search). It is a drop-in
+    replacement for `InMemoryDocstore` in a langchain FAISS vector store (and pickles compactly with `save_local`).
+    Missing metadata values (NaN/None) come back as NaN, as in the movie dataframe.
+    """
+
+    def __init__(self):
+        self._row_of = {}      # document id -> row
+        self._num_rows = 0     # including rows of deleted documents
+        self._page_contents = _StringColumn()
+        self._missing = {}     # metadata key -> _Buffer(bool)
+        self._columns = {}     # metadata key -> column
+
+    def __len__(self):
+        return len(self._row_of)
+
+    def _append_metadata(self, key, value):
+
+        if key not in self._columns:
+            self._columns[key] = _new_column(value)
+            self._missing[key] = _Buffer(bool)
+            for _ in range(self._num_rows):  # backfill rows added before the key first appeared
+                self._columns[key].append_missing()
+                self._missing[key].append(True)
+
+        column = self._columns[key]
+
+        if isinstance(value, pd.api.extensions.ExtensionArray):
+            value = np.asarray(value, dtype=object)
+
+        if not column.accepts(value):
+            # e.g. a value of a different type than the ones seen so far: fall back to a python list
+            column = self._columns[key] = _ObjectColumn(
+                None if self._missing[key][row] else column.get(row) for row in range(self._num_rows))
+
+        column.append(value)
+        self._missing[key].append(False)
+
+    def add(self, texts):
+        """
+        Add documents, given as a {document id: Document} dict
+        """
+
+        overlapping = set(texts).intersection(self._row_of)
+        if overlapping:
+            raise ValueError(f'Tried to add ids that already exist: {overlapping}')
+
+        for doc_id, doc in texts.items():
+
+            self._page_contents.append(doc.page_content)
+
+            present = [key for key, value in doc.metadata.items() if not _is_missing(value)]
+
+            for key in present:
+                self._append_metadata(key, doc.metadata[key])
+
+            for key in self._columns.keys() - set(present):
+                self._columns[key].append_missing()
+                self._missing[key].append(True)
+
+            self._row_of[doc_id] = self._num_rows
+            self._num_rows += 1
+
+    def delete(self, ids):
+        """
+        Delete documents by id; their space is reclaimed by `compact`
+        """
+
+        missing = set(ids).difference(self._row_of)
+        if missing:
+            raise ValueError(f'Tried to delete ids that does not exist: {missing}')
+
+        for doc_id in ids:
+            del self._row_of[doc_id]
+
+    def search(self, search):
+        """
+        Materialize the Document with a given id (or return an error message, like `InMemoryDocstore`)
+        """
+
+        row = self._row_of.get(search)
+
+        if row is None:
+            return f'ID {search} not found.'
+
+        metadata = {key: np.nan if self._missing[key][row] else column.get(row)
+                    for key, column in self._columns.items()}
+
+        return Document(id=search, page_content=self._page_contents.get(row), metadata=metadata)
+
+    def num_deleted(self):
+        return self._num_rows - len(self._row_of)
+
+    def compact(self):
+        """
+        Rewrite the columns without the rows of deleted documents
+        """
+
+        if not self.num_deleted():
+            return
+
+        documents = {doc_id: self.search(doc_id) for doc_id in sorted(self._row_of, key=self._row_of.get)}
+
+        self.__init__()
+        self.add(documents)
@@ -0,0 +1,170 @@
+import os
+import json
+import hashlib
+import threading
+import numpy as np
+from collections import OrderedDict
+
+
+def embedding_key(model_name, text):
+    """
+    Content-address of an embedding: hash of the model that produced it and the text it encodes
+    """
+
+    return hashlib.sha256(f'{model_name}\0{text}'.encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Persistent, size-capped (LRU) cache of text embeddings
+
+    The vectors live in a memory-mapped float32 matrix (`embeddings.f32`) with one row per slot, while the key index
+    (`index.json`) maps each content hash to its row, in least- to most-recently used order. When the cache is full,
+    the least recently used entry is evicted. Its row is only reused after the next `save`, i.e. once `index.json` no
+    longer points to it, so that a crash never leaves a key pointing to another key's vector (the matrix grows
+    instead if there are no free rows left in the meantime).
+    """
+
+    def __init__(self, cache_dir, model_name, dim, max_entries=1_000_000):
+
+        self.cache_dir = cache_dir
+        self.model_name = model_name
+        self.dim = dim
+        self.max_entries = max_entries
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self._index_path = os.path.join(cache_dir, 'index.json')
+        self._matrix_path = os.path.join(cache_dir, 'embeddings.f32')
+
+        self._slots = OrderedDict()  # key -> row of the matrix, in LRU order
+        self._evicted_slots = []  # rows of evicted entries, still referenced by the saved index.json
+        self._lock = threading.Lock()  # `save` may be called (e.g. at checkpoints) while another thread embeds
+        num_rows = max_entries
+
+        if os.path.isfile(self._index_path):
+            with open(self._index_path) as f:
+                index = json.load(f)
+
+            if index['dim'] != dim:
+                raise ValueError(f'Embedding cache under {cache_dir} has dim {index["dim"]}, expected {dim}')
+
+            self._slots.update(index['slots'])
+            num_rows = max(num_rows, index['num_rows'])  # never shrink an existing matrix
+
+        self._map_matrix(num_rows)
+
+        self._free_slots = sorted(set(range(num_rows)) - set(self._slots.values()), reverse=True)
+
+        while len(self._slots) > max_entries:  # cap was lowered since the cache was written
+            self._evict()
+
+    def __len__(self):
+        return len(self._slots)
+
+    def _map_matrix(self, num_rows):
+
+        with open(self._matrix_path, 'ab') as f:  # create or grow the (sparse) matrix file
+            if f.tell() < num_rows * self.dim * 4:
+                f.truncate(num_rows * self.dim * 4)
+
+        self._matrix = np.memmap(self._matrix_path, dtype=np.float32, mode='r+', shape=(num_rows, self.dim))
+
+    def _grow(self):
+        """
+        Add rows to the matrix, when all free rows are waiting for the next `save` to be reused
+        """
+
+        num_rows = len(self._matrix)
+        extra_rows = max(1, min(self.max_entries, 4096))
+
+        self._matrix.flush()
+        self._map_matrix(num_rows + extra_rows)
+
+        self._free_slots.extend(range(num_rows + extra_rows - 1, num_rows - 1, -1))
+
+    def _evict(self):
+        _, slot = self._slots.popitem(last=False)
+        self._evicted_slots.append(slot)
+        self.evictions += 1
+
+    def get(self, key):
+        """
+        Return the cached vector of a key (marking it as recently used) or None
+        """
+
+        with self._lock:
+            slot = self._slots.get(key)
+
+            if slot is None:
+                self.misses += 1
+                return None
+
+            self._slots.move_to_end(key)
+            self.hits += 1
+
+            return np.array(self._matrix[slot])
+
+    def put(self, key, vector):
+        """
+        Store a vector under a key, evicting the least recently used entry if the cache is full
+        """
+
+        with self._lock:
+            if key in self._slots:
+                self._slots.move_to_end(key)
+                slot = self._slots[key]
+            else:
+                if len(self._slots) >= self.max_entries:
+                    self._evict()
+                if not self._free_slots:
+                    self._grow()
+                slot = self._free_slots.pop()
+                self._slots[key] = slot
+
+            self._matrix[slot] = vector
+
+    def embed_documents(self, texts, embedding_function):
+        """
+        Embed a list of texts, computing (with `embedding_function`) only the ones missing from the cache
+        """
+
+        keys = [embedding_key(self.model_name, text) for text in texts]
+        vectors = [self.get(key) for key in keys]
+
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+
+        if missing:
+            new_vectors = embedding_function.embed_documents([texts[i] for i in missing])
+
+            for i, vector in zip(missing, new_vectors):
+                vectors[i] = np.asarray(vector, dtype=np.float32)
+                self.put(keys[i], vectors[i])
+
+        return [vector.tolist() for vector in vectors]
+
+    def save(self):
+        """
+        Flush the vectors to disk and atomically write the key index; rows of evicted entries can be reused afterwards
+        """
+
+        with self._lock:
+            self._matrix.flush()
+
+            tmp_path = self._index_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump({'model_name': self.model_name, 'dim': self.dim, 'num_rows': len(self._matrix),
+                           'slots': list(self._slots.items())}, f)
+            os.replace(tmp_path, self._index_path)
+
+            self._free_slots.extend(self._evicted_slots)
+            self._evicted_slots = []
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'entries': len(self), 'max_entries': self.max_entries, 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'hit_rate': round(self.hits / total, 4) if total else 0.}
@@ -0,0 +1,38 @@
+import os
+import json
+import faiss
+
+
+MANIFEST_FILENAME = 'manifest.json'
+
+
+def write_manifest(vector_store, save_dir):
+    """
+    Describe a saved index (embedding model, dimension, size and index type) in a small JSON file, so that it can be
+    loaded without instantiating the embedding model first
+    """
+
+    index = faiss.downcast_index(vector_store.index)
+
+    manifest = {'model_name': getattr(vector_store.embedding_function, 'model_name', None),
+                'dim': index.d,
+                'stored_dim': index.index.d if isinstance(index, faiss.IndexPreTransform) else index.d,  # projected
+                'num_vectors': index.ntotal,
+                'index_type': type(index).__name__}
+
+    with open(os.path.join(save_dir, MANIFEST_FILENAME), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+
+def read_manifest(save_dir):
+    """
+    Manifest of a saved index, or an empty dict for indexes saved before manifests were written
+    """
+
+    path = os.path.join(save_dir, MANIFEST_FILENAME)
+
+    if not os.path.isfile(path):
+        return {}
+
+    with open(path) as f:
+        return json.load(f)
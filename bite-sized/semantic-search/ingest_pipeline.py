@@ -0,0 +1,136 @@
+import time
+import queue
+import threading
+
+
+_STOP = object()  # sentinel that signals the end of the stream to the next stage
+
+
+class StageStats:
+    """
+    Timing counters of a single pipeline stage
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.batches = 0
+        self.items = 0
+        self.busy_time = 0.    # seconds spent doing actual work
+        self.input_wait = 0.   # seconds spent waiting for the previous stage (starved)
+        self.output_wait = 0.  # seconds spent waiting for the next stage (backpressure)
+
+    @property
+    def throughput(self):
+        return self.items / self.busy_time if self.busy_time else 0.
+
+    def as_dict(self):
+        return {'stage': self.name,
+                'batches': self.batches,
+                'items': self.items,
+                'busy_time': round(self.busy_time, 3),
+                'input_wait': round(self.input_wait, 3),
+                'output_wait': round(self.output_wait, 3),
+                'items_per_sec': round(self.throughput, 1)}
+
+    def __str__(self):
+        return (f'{self.name:>10}: {self.items} items in {self.batches} batches | {self.throughput:.1f} items/s | '
+                f'busy {self.busy_time:.2f}s | waiting on input {self.input_wait:.2f}s | '
+                f'waiting on output {self.output_wait:.2f}s')
+
+
+def _timed_put(q, item, stats):
+    start = time.perf_counter()
+    q.put(item)
+    stats.output_wait += time.perf_counter() - start
+
+
+def _run_stage(func, in_queue, out_queue, stats, errors, count_items):
+    """
+    Worker loop of a stage: get from `in_queue`, apply `func`, put result in `out_queue` until the stream ends
+
+    If any stage fails, the rest of the input is drained (so that upstream threads don't block on a full queue)
+    and the stop signal is still forwarded downstream.
+    """
+
+    while True:
+
+        start = time.perf_counter()
+        item = in_queue.get()
+        stats.input_wait += time.perf_counter() - start
+
+        if item is _STOP:
+            break
+
+        if errors:
+            continue  # another stage failed, just drain
+
+        try:
+            start = time.perf_counter()
+            result = func(item)
+            stats.busy_time += time.perf_counter() - start
+        except Exception as e:
+            errors.append(e)
+            continue
+
+        stats.batches += 1
+        stats.items += count_items(item)
+
+        if out_queue is not None:
+            _timed_put(out_queue, result, stats)
+
+    if out_queue is not None:
+        out_queue.put(_STOP)
+
+
+def run_pipeline(source, stages, queue_size=2, count_items=len, progress=None):
+    """
+    Run a chain of stages concurrently, each in its own thread, connected through bounded queues
+
+    :param source: iterable that produces the inputs of the first stage (consumed by the calling thread)
+    :param stages: list of (name, func) pairs; each func receives the output of the previous one
+    :param queue_size: max number of batches waiting between two stages; bounds the memory of the pipeline
+    :param count_items: function that counts the items of a stage's input (for the throughput stats)
+    :param progress: optional callable invoked after every batch read from the source (e.g. tqdm's `update`)
+    :return: list of StageStats, the first one referring to the source
+    """
+
+    queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+    stats = [StageStats('source')] + [StageStats(name) for name, _ in stages]
+    errors = []
+
+    threads = []
+    for i, (name, func) in enumerate(stages):
+        out_queue = queues[i + 1] if i + 1 < len(stages) else None
+        thread = threading.Thread(target=_run_stage, name=f'pipeline-{name}', daemon=True,
+                                  args=(func, queues[i], out_queue, stats[i + 1], errors, count_items))
+        thread.start()
+        threads.append(thread)
+
+    source_stats = stats[0]
+    iterator = iter(source)
+
+    try:
+        while not errors:
+
+            start = time.perf_counter()
+            try:
+                batch = next(iterator)
+            except StopIteration:
+                break
+            source_stats.busy_time += time.perf_counter() - start
+            source_stats.batches += 1
+            source_stats.items += count_items(batch)
+
+            _timed_put(queues[0], batch, source_stats)
+
+            if progress is not None:
+                progress()
+    finally:
+        queues[0].put(_STOP)
+        for thread in threads:
+            thread.join()
+
+    if errors:
+        raise errors[0]
+
+    return stats
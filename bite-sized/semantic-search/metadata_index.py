@@ -0,0 +1,300 @@
+import faiss
+import numpy as np
+
+
+LIST_FIELDS = ('actors', 'genres', 'languages', 'countries')
+RANGE_FIELDS = ('runtime', 'release_date', 'box_office')
+
+_RANGE_OPERATORS = ('$eq', '$gt', '$gte', '$lt', '$lte')
+
+
+def _check_value(field, operator, value, types=(str, int, float)):
+    """
+    Filters come from requests: reject operands of the wrong type (e.g. a list where a single value is expected)
+    with a ValueError, rather than failing deep in numpy or silently matching nothing
+    """
+
+    if isinstance(value, bool) or not isinstance(value, types):
+        expected = ' or '.join(t.__name__ for t in types)
+        raise ValueError(f'{operator} on field {field!r} takes a single {expected} value, got {value!r}')
+
+
+def _check_values(field, operator, values):
+
+    if not isinstance(values, (list, tuple)):
+        raise ValueError(f'{operator} on field {field!r} takes a list of values, got {values!r}')
+
+    for value in values:
+        _check_value(field, operator, value)
+
+
+def _as_list(value):
+    """
+    Metadata list fields can be lists, numpy arrays or NaN (missing)
+    """
+
+    import pandas as pd  # only needed to build the index, so loading it (e.g. in the search service) stays fast
+
+    if isinstance(value, (list, tuple, np.ndarray, pd.api.extensions.ExtensionArray)):
+        return list(value)
+
+    return []
+
+
+class MetadataIndex:
+    """
+    Indexes over the metadata of the vectors of a FAISS vector store, used to pre-filter similarity searches
+
+        - list fields (actors, genres, languages, countries) get an inverted index: value -> sorted vector positions
+        - range fields (runtime, release_date, box_office) get their values sorted, along with the vector positions
+          they belong to, so that a range query is two binary searches
+
+    Positions are the sequential ids of the FAISS index, so the index needs to be rebuilt whenever vectors are
+    removed from the store (see `populate_movie_faiss.save_vector_store`).
+    """
+
+    def __init__(self, ntotal, inverted, ranges):
+        self.ntotal = ntotal
+        self.inverted = inverted  # field -> {value: sorted np.ndarray of positions}
+        self.ranges = ranges      # field -> (sorted np.ndarray of values, np.ndarray of positions)
+
+    @classmethod
+    def build(cls, vector_store):
+        """
+        Build the indexes by scanning the metadata of all documents in the vector store
+        """
+
+        import pandas as pd
+
+        postings = {field: {} for field in LIST_FIELDS}
+        values = {field: [] for field in RANGE_FIELDS}
+
+        for position in range(vector_store.index.ntotal):
+
+            metadata = vector_store.docstore.search(vector_store.index_to_docstore_id[position]).metadata
+
+            for field in LIST_FIELDS:
+                for value in _as_list(metadata.get(field)):
+                    postings[field].setdefault(value, []).append(position)
+
+            for field in RANGE_FIELDS:
+                value = metadata.get(field)
+                if not pd.isna(value):
+                    values[field].append((value, position))
+
+        inverted = {field: {value: np.array(positions, dtype=np.int64) for value, positions in field_postings.items()}
+                    for field, field_postings in postings.items()}
+
+        ranges = {}
+        for field, field_values in values.items():
+            field_values.sort()
+            ranges[field] = (np.array([value for value, _ in field_values]),
+                             np.array([position for _, position in field_values], dtype=np.int64))
+
+        return cls(vector_store.index.ntotal, inverted, ranges)
+
+    def save(self, path):
+        """
+        Save the indexes in a single .npz file; inverted indexes are stored in CSR format (vocabulary, offsets, ids)
+        """
+
+        arrays = {'ntotal': np.array(self.ntotal)}
+
+        for field, field_postings in self.inverted.items():
+            vocabulary = list(field_postings)
+            arrays[f'{field}.vocabulary'] = np.array(vocabulary, dtype=str)
+            arrays[f'{field}.offsets'] = np.cumsum([0] + [len(field_postings[value]) for value in vocabulary])
+            arrays[f'{field}.positions'] = (np.concatenate([field_postings[value] for value in vocabulary])
+                                            if vocabulary else np.array([], dtype=np.int64))
+
+        for field, (field_values, positions) in self.ranges.items():
+            arrays[f'{field}.values'] = field_values
+            arrays[f'{field}.value_positions'] = positions
+
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+
+        with np.load(path) as arrays:
+
+            inverted = {}
+            for field in LIST_FIELDS:
+                vocabulary = arrays[f'{field}.vocabulary'].tolist()
+                offsets, positions = arrays[f'{field}.offsets'], arrays[f'{field}.positions']
+                inverted[field] = {value: positions[offsets[i]:offsets[i + 1]] for i, value in enumerate(vocabulary)}
+
+            ranges = {field: (arrays[f'{field}.values'], arrays[f'{field}.value_positions']) for field in RANGE_FIELDS}
+
+            return cls(int(arrays['ntotal']), inverted, ranges)
+
+    def _resolve_list_field(self, field, condition):
+
+        field_postings = self.inverted[field]
+
+        def _positions(value):
+            return field_postings.get(value, np.array([], dtype=np.int64))
+
+        if not isinstance(condition, dict):
+            _check_value(field, '$eq', condition)
+            return _positions(condition)
+
+        result = np.arange(self.ntotal)
+
+        for operator, operand in condition.items():
+            if operator in ('$in', '$all', '$nin'):
+                _check_values(field, operator, operand)
+
+            if operator == '$in':
+                positions = np.unique(np.concatenate([_positions(value) for value in operand] or [[]])).astype(np.int64)
+                result = np.intersect1d(result, positions, assume_unique=True)
+            elif operator == '$all':
+                for value in operand:
+                    result = np.intersect1d(result, _positions(value), assume_unique=True)
+            elif operator == '$nin':
+                for value in operand:
+                    result = np.setdiff1d(result, _positions(value), assume_unique=True)
+            else:
+                raise ValueError(f'Unsupported operator {operator!r} for field {field!r}; use $in, $all or $nin')
+
+        return result
+
+    def _resolve_range_field(self, field, condition):
+
+        field_values, positions = self.ranges[field]
+
+        if not isinstance(condition, dict):
+            condition = {'$eq': condition}
+
+        lo, hi = 0, len(field_values)
+
+        # values have to be comparable with the field's: numbers for runtime/box office, ISO strings for dates
+        if not len(field_values):  # no movie has a value, so the array's type says nothing
+            types = (str, int, float)
+        elif field_values.dtype.kind in 'US':
+            types = (str,)
+        else:
+            types = (int, float)
+
+        for operator, operand in condition.items():
+            if operator in _RANGE_OPERATORS:
+                _check_value(field, operator, operand, types)
+
+            if operator == '$eq':
+                lo = max(lo, np.searchsorted(field_values, operand, side='left'))
+                hi = min(hi, np.searchsorted(field_values, operand, side='right'))
+            elif operator == '$gt':
+                lo = max(lo, np.searchsorted(field_values, operand, side='right'))
+            elif operator == '$gte':
+                lo = max(lo, np.searchsorted(field_values, operand, side='left'))
+            elif operator == '$lt':
+                hi = min(hi, np.searchsorted(field_values, operand, side='left'))
+            elif operator == '$lte':
+                hi = min(hi, np.searchsorted(field_values, operand, side='right'))
+            else:
+                raise ValueError(f'Unsupported operator {operator!r} for field {field!r}; use one of {_RANGE_OPERATORS}')
+
+        return np.sort(positions[lo:hi]) if lo < hi else np.array([], dtype=np.int64)
+
+    def resolve(self, filter):
+        """
+        Resolve a declarative filter to the (sorted) positions of the vectors that satisfy it
+
+        Conditions on different fields are combined with AND. Examples:
+            {'actors': 'Tom Cruise'}                            # list field contains a value
+            {'genres': {'$in': ['Science Fiction', 'Space opera']}, 'languages': {'$nin': ['French Language']}}
+            {'runtime': {'$gt': 60, '$lt': 120}}                # range fields support $eq, $gt, $gte, $lt, $lte
+            {'release_date': {'$gte': '1990', '$lt': '2000'}}   # dates are ISO strings, compared lexicographically
+        """
+
+        result = np.arange(self.ntotal)
+
+        for field, condition in filter.items():
+
+            if field in LIST_FIELDS:
+                positions = self._resolve_list_field(field, condition)
+            elif field in RANGE_FIELDS:
+                positions = self._resolve_range_field(field, condition)
+            else:
+                raise ValueError(f'Field {field!r} is not indexed; indexed fields: {LIST_FIELDS + RANGE_FIELDS}')
+
+            result = np.intersect1d(result, positions, assume_unique=True)
+
+        return result
+
+
+def _search_parameters(index, selector):
+    """
+    Search parameters that restrict a search to the vectors accepted by `selector`, keeping the index's own knobs
+    """
+
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        return faiss.SearchParametersIVF(sel=selector, nprobe=ivf.nprobe)
+
+    downcast = faiss.downcast_index(index)
+    if hasattr(downcast, 'hnsw'):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=downcast.hnsw.efSearch)
+
+    return faiss.SearchParameters(sel=selector)
+
+
+def search_positions(index, query_vector, positions, k=4, exact_threshold=20_000):
+    """
+    Search for the k nearest neighbors of a query among the given vector positions only
+
+    Small candidate sets (up to `exact_threshold` vectors) are scored by brute force over their reconstructed vectors,
+    which is faster than a restricted index search and doesn't miss candidates the way IVF/HNSW searches can. With
+    compressed indexes (PQ/SQ), the reconstructed vectors (and thus the distances and ranking) are still
+    approximations of the original ones. Larger sets are searched through the index with an IDSelector, so the
+    results are as approximate as the index's unfiltered search.
+    """
+
+    if hasattr(index, 'search_positions'):  # e.g. sharded_index.ShardedIndex, which fans out over its shards
+        return index.search_positions(query_vector, positions, k=k, exact_threshold=exact_threshold)
+
+    query_vector = np.asarray(query_vector, dtype=np.float32).reshape(1, -1)
+
+    if len(positions) == 0:
+        return np.array([], dtype=np.float32), np.array([], dtype=np.int64)
+
+    if len(positions) <= exact_threshold:
+        try:
+            vectors = index.reconstruct_batch(positions)
+        except RuntimeError:  # IVF indexes can only reconstruct vectors through a direct map
+            faiss.extract_index_ivf(index).make_direct_map()
+            vectors = index.reconstruct_batch(positions)
+
+        distances = ((vectors - query_vector) ** 2).sum(axis=1)
+        top = np.argsort(distances)[:k]
+
+        return distances[top], positions[top]
+
+    selector = faiss.IDSelectorBatch(positions)
+    params = _search_parameters(getattr(index, 'coarse_index', index), selector)  # see two_stage_index.TwoStageIndex
+    distances, ids = index.search(query_vector, k, params=params)
+
+    found = ids[0] >= 0
+
+    return distances[0][found], ids[0][found]
+
+
+def prefiltered_similarity_search(vector_store, metadata_index, query, filter, k=4, exact_threshold=20_000):
+    """
+    Similarity search restricted to the documents satisfying a declarative metadata filter (see
+    `MetadataIndex.resolve`)
+
+    Unlike the `filter` argument of `FAISS.similarity_search` (post-filtering of `fetch_k` candidates), the filter is
+    applied *before* the vector search, so we always get the k best matches among the documents that satisfy it.
+
+    Returns a list of (Document, L2 distance) tuples.
+    """
+
+    positions = metadata_index.resolve(filter)
+
+    query_vector = vector_store.embedding_function.embed_query(query)
+    distances, positions = search_positions(vector_store.index, query_vector, positions, k=k,
+                                            exact_threshold=exact_threshold)
+
+    return [(vector_store.docstore.search(vector_store.index_to_docstore_id[position]), float(distance))
+            for distance, position in zip(distances, positions)]
@@ -0,0 +1,91 @@
+import os
+import json
+import math
+import mmap
+import numpy as np
+from langchain_core.documents import Document
+
+
+DOCSTORE_FILENAME = 'docstore.jsonl'
+OFFSETS_FILENAME = 'docstore_offsets.npy'
+
+
+def _to_json(value):
+    """
+    Metadata can contain numpy arrays/scalars, which json can't serialize by itself
+    """
+
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+
+    return list(value) if hasattr(value, '__iter__') else str(value)
+
+
+def _missing_to_none(value):
+    """
+    Missing values are NaN in the movie table, which is not valid JSON
+    """
+
+    return None if isinstance(value, float) and math.isnan(value) else value
+
+
+def write_mmap_docstore(vector_store, save_dir):
+    """
+    Write the documents of a vector store in FAISS position order as JSON lines, along with the byte offset of each
+    line, so that they can be read with `MmapDocstore` without unpickling anything
+    """
+
+    offsets = [0]
+
+    with open(os.path.join(save_dir, DOCSTORE_FILENAME), 'wb') as f:
+
+        for position in range(vector_store.index.ntotal):
+            doc_id = vector_store.index_to_docstore_id[position]
+            doc = vector_store.docstore.search(doc_id)
+
+            metadata = {key: _missing_to_none(value) for key, value in doc.metadata.items()}
+
+            line = json.dumps({'id': doc_id, 'page_content': doc.page_content, 'metadata': metadata},
+                              default=_to_json).encode('utf-8') + b'\n'
+
+            f.write(line)
+            offsets.append(offsets[-1] + len(line))
+
+    np.save(os.path.join(save_dir, OFFSETS_FILENAME), np.array(offsets, dtype=np.int64))
+
+
+class MmapDocstore:
+    """
+    Read-only docstore over the files written by `write_mmap_docstore`
+
+    Both files are memory-mapped, so opening it is instant regardless of its size, only the documents that are
+    actually requested are ever parsed and the pages are shared between all processes that open the same files
+    (e.g. multiple workers of the search service).
+    """
+
+    def __init__(self, save_dir):
+
+        with open(os.path.join(save_dir, DOCSTORE_FILENAME), 'rb') as f:
+            # mmap can't map empty files
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b''
+
+        self._offsets = np.load(os.path.join(save_dir, OFFSETS_FILENAME), mmap_mode='r')
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def get_record(self, position):
+        """
+        Raw record ({'id', 'page_content', 'metadata'}) of the document stored at a FAISS position
+        """
+
+        return json.loads(self._data[self._offsets[position]:self._offsets[position + 1]])
+
+    def get(self, position):
+        """
+        Document stored at a FAISS position
+        """
+
+        record = self.get_record(position)
+
+        return Document(page_content=record['page_content'], metadata=record['metadata'], id=record['id'])
@@ -0,0 +1,293 @@
+import json
+import time
+import threading
+import numpy as np
+from collections import OrderedDict
+
+from metadata_index import search_positions
+
+
+class QueryEmbeddingCache:
+    """
+    Thread-safe LRU cache of query embeddings
+    """
+
+    def __init__(self, max_size=10_000):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._embeddings = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._embeddings)
+
+    def get(self, query):
+
+        with self._lock:
+            embedding = self._embeddings.get(query)
+
+            if embedding is None:
+                self.misses += 1
+            else:
+                self._embeddings.move_to_end(query)
+                self.hits += 1
+
+            return embedding
+
+    def put(self, query, embedding):
+
+        with self._lock:
+            self._embeddings[query] = embedding
+            self._embeddings.move_to_end(query)
+
+            while len(self._embeddings) > self.max_size:
+                self._embeddings.popitem(last=False)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'size': len(self), 'max_size': self.max_size, 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else 0.}
+
+
+class SemanticResultCache:
+    """
+    Thread-safe cache of search results keyed on the query embedding rather than the query text
+
+    A search is answered from the cache if a cached query had the same filter, at least as many results and an
+    embedding within `threshold` cosine similarity of the new one, so paraphrases ("gangster movie", "gangster
+    movies") share an entry. The cached results (including their distances) are those of the cached query.
+
+    Embeddings are kept in a single matrix, so a lookup is one matrix-vector product. Entries expire after `ttl`
+    seconds and the least recently used one is evicted when the cache is full.
+    """
+
+    def __init__(self, max_size=10_000, threshold=0.95, ttl=3600):
+        self.max_size = max_size
+        self.threshold = threshold
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        self._embeddings = None                              # (max_size, dim) unit vectors, allocated on first put
+        self._filter_hashes = np.zeros(max_size, dtype=np.int64)
+        self._ks = np.zeros(max_size, dtype=np.int64)
+        self._expires = np.zeros(max_size)                   # 0: free slot
+        self._entries = [None] * max_size                    # (filter key, results)
+        self._lru = OrderedDict()                            # occupied slots, least recently used first
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._lru)
+
+    @staticmethod
+    def _filter_key(filter):
+        return json.dumps(filter, sort_keys=True, default=str) if filter else ''
+
+    @staticmethod
+    def _normalize(embedding):
+        embedding = np.asarray(embedding, dtype=np.float32)
+        return embedding / (np.linalg.norm(embedding) or 1.)
+
+    def _free(self, slot):
+        self._expires[slot] = 0
+        self._entries[slot] = None
+        del self._lru[slot]
+
+    def get(self, embedding, k, filter=None):
+        """
+        Cached top-k of a query similar enough to this one (with the same filter), or None
+        """
+
+        key = self._filter_key(filter)
+
+        with self._lock:
+
+            if self._embeddings is None:
+                self.misses += 1
+                return None
+
+            now = time.monotonic()
+
+            for slot in np.flatnonzero((self._expires > 0) & (self._expires <= now)):
+                self._free(slot)
+                self.expirations += 1
+
+            similarities = self._embeddings @ self._normalize(embedding)
+            similarities[(self._expires == 0) | (self._filter_hashes != hash(key)) | (self._ks < k)] = -np.inf
+
+            slot = int(np.argmax(similarities))
+
+            if similarities[slot] < self.threshold or self._entries[slot][0] != key:
+                self.misses += 1
+                return None
+
+            self._lru.move_to_end(slot)
+            self.hits += 1
+
+            return self._entries[slot][1][:k]
+
+    def put(self, embedding, k, results, filter=None):
+
+        if self.max_size <= 0:
+            return
+
+        key = self._filter_key(filter)
+        embedding = self._normalize(embedding)
+
+        with self._lock:
+
+            if self._embeddings is None:
+                self._embeddings = np.zeros((self.max_size, len(embedding)), dtype=np.float32)
+
+            if len(self._lru) < self.max_size:
+                slot = int(np.argmin(self._expires))  # a free slot
+            else:
+                slot = next(iter(self._lru))
+                self._free(slot)
+                self.evictions += 1
+
+            self._embeddings[slot] = embedding
+            self._filter_hashes[slot] = hash(key)
+            self._ks[slot] = k
+            self._expires[slot] = time.monotonic() + self.ttl
+            self._entries[slot] = (key, results)
+            self._lru[slot] = None
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'size': len(self), 'max_size': self.max_size, 'threshold': self.threshold, 'ttl': self.ttl,
+                'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'expirations': self.expirations, 'hit_rate': round(self.hits / total, 4) if total else 0.}
+
+
+class VectorStoreDocuments:
+    """
+    Look up the documents of a langchain FAISS vector store by their position in the FAISS index
+    """
+
+    def __init__(self, vector_store):
+        self.vector_store = vector_store
+
+    def get(self, position):
+        return self.vector_store.docstore.search(self.vector_store.index_to_docstore_id[position])
+
+
+class MovieSearcher:
+    """
+    Search entry point over a FAISS index that handles many queries at once
+
+    Instead of one embedding call and one index search per query (as with `vector_store.similarity_search`), all
+    queries of a call are embedded in a single batch (skipping the ones whose embedding is cached) and searched with a
+    single batched `index.search`.
+
+    :param index: the FAISS index
+    :param embedding_function: langchain embeddings used to embed the queries
+    :param documents: any object whose `get(position)` returns the Document stored at a position of the index (e.g.
+                      `VectorStoreDocuments` or `mmap_docstore.MmapDocstore`)
+    :param metadata_index: optional `metadata_index.MetadataIndex`, needed for filtered searches
+    :param result_cache: optional `SemanticResultCache`, to answer searches for near-duplicate queries without
+                         searching the index
+    """
+
+    def __init__(self, index, embedding_function, documents, metadata_index=None, query_cache_size=10_000,
+                 result_cache=None):
+        self.index = index
+        self.embedding_function = embedding_function
+        self.documents = documents
+        self.metadata_index = metadata_index
+        self.query_cache = QueryEmbeddingCache(max_size=query_cache_size)
+        self.result_cache = result_cache
+
+    @classmethod
+    def from_vector_store(cls, vector_store, metadata_index=None, query_cache_size=10_000, result_cache=None):
+        return cls(vector_store.index, vector_store.embedding_function, VectorStoreDocuments(vector_store),
+                   metadata_index=metadata_index, query_cache_size=query_cache_size, result_cache=result_cache)
+
+    def embed_queries(self, queries):
+        """
+        Embed a list of queries, computing the missing ones in one batch; returns a (len(queries), dim) float32 array
+        """
+
+        embeddings = [self.query_cache.get(query) for query in queries]
+
+        # unique, so that a query repeated within the same call is embedded only once
+        missing = list(dict.fromkeys(query for query, embedding in zip(queries, embeddings) if embedding is None))
+
+        if missing:
+            # for sentence-transformers models, embedding queries as documents gives the same vectors, but batched
+            new_embeddings = dict(zip(missing, np.asarray(
+                self.embedding_function.embed_documents(missing), dtype=np.float32)))
+
+            for query, embedding in new_embeddings.items():
+                self.query_cache.put(query, embedding)
+
+            embeddings = [new_embeddings[query] if embedding is None else embedding
+                          for query, embedding in zip(queries, embeddings)]
+
+        return np.vstack(embeddings).astype(np.float32, copy=False)
+
+    def search_vectors(self, query_vectors, k=4):
+        """
+        Batched k-NN search of already embedded queries; returns a list of [(Document, L2 distance), ...] per query
+        """
+
+        distances, positions = self.index.search(np.asarray(query_vectors, dtype=np.float32), k)
+
+        return [[(self.documents.get(position), float(distance))
+                 for distance, position in zip(query_distances, query_positions) if position >= 0]
+                for query_distances, query_positions in zip(distances, positions)]
+
+    def search(self, queries, k=4):
+        """
+        Search for the k most similar movies of each query in a list of queries
+
+        :return: a list with one list of (Document, L2 distance) tuples per query, in the order of `queries`
+        """
+
+        if not queries:
+            return []
+
+        query_vectors = self.embed_queries(queries)
+
+        if self.result_cache is None:
+            return self.search_vectors(query_vectors, k=k)
+
+        results = [self.result_cache.get(query_vector, k) for query_vector in query_vectors]
+        missing = [i for i, query_results in enumerate(results) if query_results is None]
+
+        if missing:  # the queries not answered from the cache are still searched in a single batch
+            for i, query_results in zip(missing, self.search_vectors(query_vectors[missing], k=k)):
+                results[i] = query_results
+                self.result_cache.put(query_vectors[i], k, query_results)
+
+        return results
+
+    def filtered_search(self, query, filter, k=4):
+        """
+        Search restricted to the movies that satisfy a declarative metadata filter (see `MetadataIndex.resolve`)
+
+        :return: a list of (Document, L2 distance) tuples
+        """
+
+        if self.metadata_index is None:
+            raise ValueError('Filtered searches need a metadata index')
+
+        query_vector = self.embed_queries([query])[0]
+
+        if self.result_cache is not None:
+            results = self.result_cache.get(query_vector, k, filter=filter)
+            if results is not None:
+                return results
+
+        positions = self.metadata_index.resolve(filter)
+        distances, positions = search_positions(self.index, query_vector, positions, k=k)
+
+        results = [(self.documents.get(position), float(distance)) for distance, position in zip(distances, positions)]
+
+        if self.result_cache is not None:
+            self.result_cache.put(query_vector, k, results, filter=filter)
+
+        return results
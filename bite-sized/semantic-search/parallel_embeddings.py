@@ -0,0 +1,76 @@
+import os
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from langchain_core.embeddings import Embeddings
+from langchain_huggingface import HuggingFaceEmbeddings
+
+
+_worker_embeddings = None  # the embedding model of the current worker process
+
+
+def _init_worker(embeddings_class, model_name, threads_per_worker):
+    """
+    Runs once in every worker process: pin the number of threads and load the embedding model
+    """
+
+    global _worker_embeddings
+
+    # torch (and the BLAS libraries it uses) would otherwise start one thread per core in *every* worker
+    for variable in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'TOKENIZERS_PARALLELISM'):
+        os.environ[variable] = 'false' if variable == 'TOKENIZERS_PARALLELISM' else str(threads_per_worker)
+
+    try:
+        import torch
+        torch.set_num_threads(threads_per_worker)
+    except ImportError:
+        pass
+
+    _worker_embeddings = embeddings_class(model_name=model_name)
+
+
+def _embed_in_worker(texts):
+    return np.asarray(_worker_embeddings.embed_documents(texts), dtype=np.float32)
+
+
+class MultiProcessEmbeddings(Embeddings):
+    """
+    Embeddings that are computed by a pool of worker processes, each one with its own copy of the model
+
+    Every call to `embed_documents` is split in contiguous chunks, one per worker, and the results are concatenated
+    in the original order, so the output is identical to (and in the same order as) the single-process model's.
+    Useful on many-core CPU machines, where a single model instance can't keep all cores busy.
+    """
+
+    def __init__(self, model_name, num_workers=os.cpu_count(), threads_per_worker=1,
+                 embeddings_class=HuggingFaceEmbeddings):
+
+        self.model_name = model_name
+        self.num_workers = num_workers
+
+        # 'spawn' so that workers don't inherit the (possibly already initialized) thread pools of the parent
+        self._pool = ProcessPoolExecutor(max_workers=num_workers, mp_context=multiprocessing.get_context('spawn'),
+                                         initializer=_init_worker,
+                                         initargs=(embeddings_class, model_name, threads_per_worker))
+
+    def embed_documents(self, texts):
+
+        if not texts:
+            return []
+
+        chunk_size = -(-len(texts) // self.num_workers)
+        chunks = [texts[i:i+chunk_size] for i in range(0, len(texts), chunk_size)]
+
+        return np.concatenate(list(self._pool.map(_embed_in_worker, chunks))).tolist()
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    def close(self):
+        self._pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
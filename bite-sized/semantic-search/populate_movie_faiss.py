@@ -1,36 +1,158 @@
+import io
 import os
 import faiss
+import shutil
 import tarfile
 import requests
+import json
+import hashlib
+import argparse
+import itertools
+import numpy as np
 import pandas as pd
 from tqdm import tqdm
-from uuid import uuid4
+from ingest_pipeline import run_pipeline
+from checkpointing import IngestCheckpointer
+from columnar_docstore import ColumnarDocstore
+from embedding_cache import EmbeddingCache
+from index_manifest import read_manifest, write_manifest
+from metadata_index import MetadataIndex
+from mmap_docstore import write_mmap_docstore
+from parallel_embeddings import MultiProcessEmbeddings
+from sharded_index import (SHARDS_FILENAME, is_sharded, iter_shards, merge_shards, num_shards_of, remove_shards,
+                           shard_dir, shard_dirs)
+from two_stage_index import save_quantized_index
 from langchain_core.documents import Document
 from langchain_community.vectorstores import FAISS
 from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_community.docstore.in_memory import InMemoryDocstore
 
 
 
-def download_and_extract_movie_dataset():
+MOVIE_DATASET_URL = 'https://www.cs.cmu.edu/~ark/personas/data/MovieSummaries.tar.gz'
+MOVIE_DATASET_FILES = ('plot_summaries.txt', 'movie.metadata.tsv', 'character.metadata.tsv')  # the ones we use
+
+
+class _ResumableDownload(io.RawIOBase):
     """
-    Download and extracts the CMU Movie Summary Corpus
-    
+    Read-only stream over an archive being downloaded: the bytes of a previous (partial) download are read from disk,
+    then the rest comes from the HTTP response and is appended to the partial file
+
+    Everything read is hashed, so the archive can be extracted, saved and checksummed in a single pass.
+    """
+
+    def __init__(self, partial_path, response, chunk_size=2 ** 20):
+        self._local = open(partial_path, 'rb')
+        self._local_remaining = os.path.getsize(partial_path)
+        self._out = open(partial_path, 'ab')
+        self._chunks = response.iter_content(chunk_size=chunk_size)
+        self._buffer = b''
+        self.sha256 = hashlib.sha256()
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+
+        if self._local_remaining:
+            data = self._local.read(min(len(b), self._local_remaining))
+            self._local_remaining -= len(data)
+        else:
+            if not self._buffer:
+                self._buffer = next(self._chunks, b'')
+                self._out.write(self._buffer)
+            data, self._buffer = self._buffer[:len(b)], self._buffer[len(b):]
+
+        self.sha256.update(data)
+        b[:len(data)] = data
+
+        return len(data)
+
+    def close(self):
+        self._local.close()
+        self._out.close()
+        super().close()
+
+
+def _extract_files(tar, dataset_dir, files, chunk_size=2 ** 20):
+    """
+    Extract only the given files (by name) of a tar archive, which can be a stream
+    """
+
+    os.makedirs(dataset_dir, exist_ok=True)
+
+    for member in tar:
+
+        name = os.path.basename(member.name)
+
+        if member.isfile() and name in files:
+            path = os.path.join(dataset_dir, name)
+            with tar.extractfile(member) as source, open(path + '.tmp', 'wb') as target:
+                shutil.copyfileobj(source, target, chunk_size)
+            os.replace(path + '.tmp', path)
+
+
+def download_and_extract_movie_dataset(url=MOVIE_DATASET_URL, archive_path='MovieSummaries.tar.gz', extract_dir='.',
+                                       sha256=None, files=MOVIE_DATASET_FILES, chunk_size=2 ** 20):
+    """
+    Download the CMU Movie Summary Corpus and extract the files we use under `extract_dir`/MovieSummaries
+
+        - if the archive was already downloaded and its checksum matches (`sha256` if given, otherwise the one recorded
+          when it was downloaded), it isn't downloaded again
+        - an interrupted download is resumed where it stopped (with an HTTP Range request)
+        - the archive is extracted while it's being downloaded and only `files` are written to disk
+
     https://www.cs.cmu.edu/~ark/personas/
     """
-    
-    url = 'https://www.cs.cmu.edu/~ark/personas/data/MovieSummaries.tar.gz'
-    filename = 'MovieSummaries.tar.gz'
 
-    response = requests.get(url, stream=True)
+    dataset_dir = os.path.join(extract_dir, 'MovieSummaries')
+    checksum_path = archive_path + '.sha256'
+
+    if os.path.isfile(archive_path) and os.path.isfile(checksum_path):
+
+        with open(checksum_path) as f:
+            recorded_sha256 = f.read().strip()
+
+        if file_checksum(archive_path) == (sha256 or recorded_sha256):
+            if not all(os.path.isfile(os.path.join(dataset_dir, name)) for name in files):
+                with tarfile.open(archive_path, 'r:gz') as tar:
+                    _extract_files(tar, dataset_dir, files, chunk_size=chunk_size)
+            return
+
+    partial_path = archive_path + '.part'
+
+    offset = os.path.getsize(partial_path) if os.path.isfile(partial_path) else 0
+    response = requests.get(url, stream=True, timeout=60, headers={'Range': f'bytes={offset}-'} if offset else {})
+
+    if offset and response.status_code != 206:  # the server ignored the range (or it's past the end): start over
+        response.close()
+        offset = 0
+        response = requests.get(url, stream=True, timeout=60)
+
+    response.raise_for_status()
+
+    if not offset:
+        open(partial_path, 'wb').close()
+
+    with response, _ResumableDownload(partial_path, response, chunk_size=chunk_size) as download:
 
-    with open('MovieSummaries.tar.gz', 'wb') as file:
-        for chunk in response.iter_content(chunk_size=1024):
-            if chunk:
-                file.write(chunk)
+        stream = io.BufferedReader(download, buffer_size=chunk_size)
 
-    with tarfile.open(filename, 'r:gz') as tar:
-        tar.extractall()
+        with tarfile.open(fileobj=stream, mode='r|gz') as tar:
+            _extract_files(tar, dataset_dir, files, chunk_size=chunk_size)
+
+        while stream.read(chunk_size):  # consume whatever follows the last member, so that the archive is complete
+            pass
+
+        digest = download.sha256.hexdigest()
+
+    if sha256 and digest != sha256:
+        os.remove(partial_path)
+        raise ValueError(f'Checksum mismatch for {url}: expected {sha256}, got {digest}')
+
+    os.replace(partial_path, archive_path)
+
+    with open(checksum_path, 'w') as f:
+        f.write(digest)
 
 
 def load_and_preprocess_summaries(movie_dataset_dir='MovieSummaries'):
@@ -46,28 +168,56 @@ def load_and_preprocess_summaries(movie_dataset_dir='MovieSummaries'):
 
     
 
+METADATA_COLUMNS = ['wikipedia_id', 'freebase_id', 'name',
+                    'release_date', 'box_office', 'runtime',
+                    'languages', 'countries', 'genres']
+
+
+# Matches the values of a freebase dict string, e.g. '{"/m/02h40lc": "English Language", "/m/06nm1": "Spanish"}'
+_FREEBASE_VALUE_PATTERN = r'"(?:[^"\\]|\\.)*": "((?:[^"\\]|\\.)*)"'
+
+
+def parse_freebase_dicts(column):
+    """
+    Convert a column of freebase dict strings (e.g. '{"/m/02h40lc": "English Language"}') to lists of their values
+
+    The values are extracted with a (vectorized) regex instead of evaluating each cell. The few cells that contain
+    escape sequences (e.g. '\\u00e9') are decoded with json, which is also safe.
+    """
+
+    column = column.fillna('{}').astype(str)
+
+    values = column.str.findall(_FREEBASE_VALUE_PATTERN)
+
+    escaped = column.str.contains('\\', regex=False)
+    if escaped.any():
+        values[escaped] = column[escaped].map(lambda str_dict: list(json.loads(str_dict).values()))
+
+    return values
+
+
+def preprocess_metadata(metadata):
+    """
+    Convert the freebase dict columns of a (chunk of the) metadata table to lists and drop unused columns
+    """
+
+    metadata['languages'] = parse_freebase_dicts(metadata['languages'])
+    metadata['countries'] = parse_freebase_dicts(metadata['countries'])
+    metadata['genres'] = parse_freebase_dicts(metadata['genres'])
+
+    return metadata.drop(columns=['freebase_id'])
+
+
 def load_and_preprocess_metadata(movie_dataset_dir='MovieSummaries'):
     """
     Load and preprocess movie metadata
     """
 
-    def _metadata_dict_to_list(str_dict):
-        return list(eval(str_dict).values())
-
     metadata = pd.read_csv(os.path.join(movie_dataset_dir, 'movie.metadata.tsv'), sep='\t', header=None)
 
-    metadata.columns = ['wikipedia_id', 'freebase_id', 'name',
-                        'release_date', 'box_office', 'runtime',
-                        'languages', 'countries', 'genres']
-    
-    
-    metadata['languages'] = metadata['languages'].apply(_metadata_dict_to_list)
-    metadata['countries'] = metadata['countries'].apply(_metadata_dict_to_list)
-    metadata['genres'] = metadata['genres'].apply(_metadata_dict_to_list)
-
-    metadata = metadata.drop(columns=['freebase_id'])
+    metadata.columns = METADATA_COLUMNS
 
-    return metadata
+    return preprocess_metadata(metadata)
 
 
 def load_and_preprocess_characters(movie_dataset_dir='MovieSummaries'):
@@ -98,8 +248,8 @@ def merge_tables(summaries, metadata, characters):
     # Merge actors into metadata table
     metadata = pd.merge(metadata, actors, how='left', left_on='wikipedia_id', right_index=True)
     
-    # Merge metadata (with actors) into summary table
-    movies = pd.merge(summaries, metadata, on='wikipedia_id').drop(columns='wikipedia_id')
+    # Merge metadata (with actors) into summary table; the wikipedia_id becomes the index (i.e. the id of each movie)
+    movies = pd.merge(summaries, metadata, on='wikipedia_id').drop_duplicates('wikipedia_id').set_index('wikipedia_id')
 
     return movies
 
@@ -121,80 +271,688 @@ def load_and_preprocess_movie_data(movie_dataset_dir='MovieSummaries'):
     return movies
     
 
-def init_faiss():
+MOVIE_TABLE_CACHE_VERSION = 1  # bump whenever the preprocessing changes, to invalidate existing caches
+
+
+def file_checksum(path, chunk_size=2 ** 20):
+    """
+    sha256 of a file, computed in chunks
+    """
+
+    digest = hashlib.sha256()
+
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def load_and_preprocess_movie_data_cached(movie_dataset_dir='MovieSummaries', cache_dir='movie_cache'):
+    """
+    Cached version of `load_and_preprocess_movie_data`
+
+    The merged movie table is stored in parquet (columnar) format, under a name derived from the checksums of the
+    source files. As long as these don't change, later runs just read the parquet file instead of parsing and merging
+    the raw tables again.
+    """
+
+    digest = hashlib.sha256(str(MOVIE_TABLE_CACHE_VERSION).encode())
+    for filename in ('plot_summaries.txt', 'movie.metadata.tsv', 'character.metadata.tsv'):
+        digest.update(file_checksum(os.path.join(movie_dataset_dir, filename)).encode())
+
+    cache_path = os.path.join(cache_dir, f'movies-{digest.hexdigest()[:16]}.parquet')
+
+    if os.path.isfile(cache_path):
+        movies = pd.read_parquet(cache_path)
+
+        # parquet gives back numpy arrays and None; restore the types produced by the preprocessing
+        for column in ('languages', 'countries', 'genres'):
+            movies[column] = movies[column].map(list)
+        movies['actors'] = movies['actors'].where(movies['actors'].notna(), np.nan)
+
+        return movies
+
+    movies = load_and_preprocess_movie_data(movie_dataset_dir=movie_dataset_dir)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    movies.assign(actors=movies['actors'].map(list, na_action='ignore')).to_parquet(cache_path + '.tmp')
+    os.replace(cache_path + '.tmp', cache_path)  # atomic, so that an interrupted write never leaves a corrupt cache
+
+    return movies
+
+
+def load_actors_lookup(movie_dataset_dir='MovieSummaries', chunksize=100_000):
+    """
+    Build a compact {wikipedia_id: array of unique actor names} lookup by streaming the character metadata
+
+    Only the two columns we need are parsed and the file is read in chunks, so the full character table is never
+    held in memory.
+    """
+
+    actors = {}
+
+    chunks = pd.read_csv(os.path.join(movie_dataset_dir, 'character.metadata.tsv'), sep='\t', header=None,
+                         usecols=[0, 8], names=['wikipedia_id', 'actor_name'], chunksize=chunksize)
+
+    for chunk in chunks:
+        for wikipedia_id, actor_names in chunk.dropna().groupby('wikipedia_id', sort=False)['actor_name']:
+            # dicts keep insertion order, so this is an order-preserving "unique" across chunks
+            actors.setdefault(wikipedia_id, {}).update(dict.fromkeys(actor_names))
+
+    return {wikipedia_id: np.array(list(names), dtype=object) for wikipedia_id, names in actors.items()}
+
+
+def load_metadata_lookup(movie_dataset_dir='MovieSummaries', chunksize=100_000):
+    """
+    Build a compact metadata lookup table (indexed by wikipedia_id) that already contains the actors of each movie
+
+    This is the "right side" of the join in `stream_movie_data`. It is much smaller than the summaries, which are
+    never loaded in full.
+    """
+
+    chunks = pd.read_csv(os.path.join(movie_dataset_dir, 'movie.metadata.tsv'), sep='\t', header=None,
+                         names=METADATA_COLUMNS, chunksize=chunksize)
+
+    metadata = pd.concat([preprocess_metadata(chunk) for chunk in chunks]).set_index('wikipedia_id')
+    metadata = metadata[~metadata.index.duplicated()]
+
+    actors = load_actors_lookup(movie_dataset_dir=movie_dataset_dir, chunksize=chunksize)
+    metadata['actors'] = metadata.index.map(actors)
+
+    return metadata
+
+
+def stream_movie_data(movie_dataset_dir='MovieSummaries', batch_size=500, metadata_lookup=None):
+    """
+    Streaming counterpart of `load_and_preprocess_movie_data`
+
+    Reads the plot summaries `batch_size` rows at a time, joins each chunk against the metadata lookup and yields
+    dataframes with the same columns as `load_and_preprocess_movie_data`. Memory usage stays flat regardless of the
+    number of summaries.
+    """
+
+    if metadata_lookup is None:
+        metadata_lookup = load_metadata_lookup(movie_dataset_dir=movie_dataset_dir)
+
+    chunks = pd.read_csv(os.path.join(movie_dataset_dir, 'plot_summaries.txt'), sep='\t', header=None,
+                         names=['wikipedia_id', 'plot_summary'], chunksize=batch_size)
+
+    for chunk in chunks:
+
+        batch = chunk.merge(metadata_lookup, left_on='wikipedia_id', right_index=True).set_index('wikipedia_id')
+
+        if len(batch):
+            yield batch
+
+
+def build_index(dim, index_spec='Flat'):
+    """
+    Build an empty FAISS index from a faiss index_factory spec, e.g.:
+        - 'Flat': exact (brute-force) search
+        - 'IVF1024,Flat': inverted file with 1024 clusters, vectors stored uncompressed
+        - 'IVF1024,PQ64': inverted file with 1024 clusters, vectors compressed to 64 bytes with product quantization
+        - 'HNSW32': HNSW graph with 32 neighbors per node
+
+    https://github.com/facebookresearch/faiss/wiki/The-index-factory
+    """
+
+    if index_spec == 'Flat':
+        return faiss.IndexFlatL2(dim)
+
+    return faiss.index_factory(dim, index_spec, faiss.METRIC_L2)
+
+
+def supports_removal(index):
+    """
+    Whether vectors can be removed from the index while keeping positions contiguous, as langchain's FAISS store
+    assumes (it renumbers the remaining vectors 0..n-1 after a deletion)
+
+    This holds for flat indexes (Flat, SQ, PQ), optionally behind a projection. IVF indexes leave gaps when vectors
+    are removed, so their positions no longer match the docstore ids, and HNSW indexes don't support removals at all.
+    """
+
+    index = faiss.downcast_index(index)
+
+    if isinstance(index, faiss.IndexPreTransform):
+        return supports_removal(index.index)
+
+    return isinstance(index, faiss.IndexFlatCodes)
+
+
+def projected_index_spec(index_spec='Flat', projection=None):
+    """
+    Prefix an index spec with a learned dimensionality reduction, e.g. 'PCA256' (PCA to 256 dims) or 'OPQ16_128'
+    (rotation optimized for PQ with 16 sub-quantizers, to 128 dims)
+
+    The projection is trained along with the index (see `train_index_on_sample`) and saved inside it, so vectors and
+    queries are projected by FAISS itself and only the reduced vectors are stored.
+    """
+
+    return f'{projection},{index_spec}' if projection else index_spec
+
+
+def init_faiss(index_spec='Flat', embeddings=None):
     """
     Initialize the FAISS vector store
+
+    :param index_spec: type of FAISS index to use (see `build_index`). IVF and PQ indexes need to be trained before
+                       vectors can be added to them (see `train_index_on_sample`).
+    :param embeddings: langchain embeddings to use instead of the default HuggingFace model (e.g. a stub, see
+                       `synthetic_corpus.StubEmbeddings`)
     """
-    
-    embeddings = HuggingFaceEmbeddings()  # by default uses 'sentence-transformers/all-mpnet-base-v2'
-    # Langchain HuggingFace wrapper documentation:
-    # https://api.python.langchain.com/en/latest/embeddings/langchain_community.embeddings.huggingface.HuggingFaceEmbeddings.html
 
-    index = faiss.IndexFlatL2(len(embeddings.embed_query('hello world')))  # 768-dim embeddings by default
+    if embeddings is None:
+        embeddings = HuggingFaceEmbeddings()  # by default uses 'sentence-transformers/all-mpnet-base-v2'
+        # Langchain HuggingFace wrapper documentation:
+        # https://api.python.langchain.com/en/latest/embeddings/langchain_community.embeddings.huggingface.HuggingFaceEmbeddings.html
+
+    index = build_index(len(embeddings.embed_query('hello world')), index_spec)  # 768-dim embeddings by default
 
     vector_store = FAISS(
         embedding_function=embeddings,
         index=index,
-        docstore=InMemoryDocstore(),
+        docstore=ColumnarDocstore(),
         index_to_docstore_id={},
     )
     
     return vector_store
 
 
-def add_batch_to_vector_store(batch, store):
+def build_documents(batch):
     """
-    Add a batch of summaries and their metadata to the vector store
+    Convert a batch of the movie dataframe to langchain Documents
     """
-    
+
     documents = []
     
     for i, row in batch.iterrows():
 
         doc = Document(page_content=row['plot_summary'],
-                       metadata=row.drop(columns='plot_summary').to_dict())
+                       metadata=row.drop('plot_summary').to_dict())
 
         documents.append(doc)
 
-    uuids = [str(uuid4()) for _ in range(len(documents))]
+    return documents
+
+
+def movie_ids(batch):
+    """
+    Stable vector store ids of a batch of movies, derived from their wikipedia_id (the index of the movie dataframe)
+    """
+
+    return [str(wikipedia_id) for wikipedia_id in batch.index]
+
 
-    store.add_documents(documents=documents, ids=uuids)
+def compute_content_hashes(batch):
+    """
+    Hash the summary and metadata of each movie in a batch, so that we can tell which movies changed between runs
+    """
 
+    def _to_json(value):
+        return list(value) if hasattr(value, '__iter__') else str(value)
+
+    return {movie_id: hashlib.sha1(json.dumps(row.to_dict(), sort_keys=True, default=_to_json).encode()).hexdigest()
+            for movie_id, (_, row) in zip(movie_ids(batch), batch.iterrows())}
+
+
+def embed_texts(texts, store, embedding_cache=None):
+    """
+    Embed texts with the store's embedding model, only computing the ones missing from the cache (if one is given)
+    """
+
+    if embedding_cache is None:
+        return store.embedding_function.embed_documents(texts)
+
+    return embedding_cache.embed_documents(texts, store.embedding_function)
+
+
+def add_batch_to_vector_store(batch, store, embedding_cache=None, content_hashes=None):
+    """
+    Add a batch of summaries and their metadata to the vector store
+
+    If a `content_hashes` dict is given, the content hash of each added movie is recorded in it (see `update_vector_store`).
+    """
     
-def populate_vector_store(movie_df, vector_store, batch_size=500):
+    documents = build_documents(batch)
+
+    ids = movie_ids(batch)
+
+    texts = [doc.page_content for doc in documents]
+    embeddings = embed_texts(texts, store, embedding_cache=embedding_cache)
+
+    store.add_embeddings(zip(texts, embeddings), metadatas=[doc.metadata for doc in documents], ids=ids)
+
+    if content_hashes is not None:
+        content_hashes.update(compute_content_hashes(batch))
+
+    
+def iter_movie_batches(movie_df, batch_size=500):
+    """
+    Slice an in-memory movie dataframe into batches
+    """
+
+    for i in range(0, len(movie_df), batch_size):
+        yield movie_df.iloc[i:i+batch_size]
+
+
+def populate_vector_store(movie_df, vector_store, batch_size=500, embedding_cache=None, content_hashes=None):
     """
     Populate vector store with data from the movie dataframe, batch-by-batch
     """
 
-    for i in tqdm(range(0, len(movies), batch_size)):
+    num_batches = -(-len(movie_df) // batch_size)
+
+    populate_vector_store_from_batches(iter_movie_batches(movie_df, batch_size), vector_store, total=num_batches,
+                                       embedding_cache=embedding_cache, content_hashes=content_hashes)
+
+
+def populate_vector_store_from_batches(movie_batches, vector_store, total=None, embedding_cache=None,
+                                       content_hashes=None, checkpointer=None):
+    """
+    Populate vector store from any iterable of movie dataframe batches (e.g. the output of `stream_movie_data`)
+
+    If a `checkpointer` is given (see `checkpointing.IngestCheckpointer`), it is notified after every batch, so that it
+    can periodically checkpoint the vector store.
+    """
+
+    for batch in tqdm(movie_batches, total=total):
+
+        add_batch_to_vector_store(batch, vector_store, embedding_cache=embedding_cache, content_hashes=content_hashes)
+
+        if checkpointer is not None:
+            checkpointer.batch_done(vector_store, content_hashes)
+
+
+def populate_vector_store_pipelined(movie_batches, vector_store, queue_size=2, total=None, embedding_cache=None,
+                                    content_hashes=None, checkpointer=None):
+    """
+    Pipelined version of `populate_vector_store_from_batches`
+
+    The work of each batch is split into three stages that run concurrently in their own threads:
+        1. prepare: build the Documents of the batch and extract their texts/metadata
+        2. embed: compute the embeddings of the texts
+        3. index: add the embeddings to the FAISS index and the documents to the docstore
+    so that while batch N is being embedded, batch N+1 is being prepared and batch N-1 is being indexed.
+    Reading the batches (e.g. from `stream_movie_data`) happens in the calling thread and overlaps with all of them.
+    Checkpoints (if a `checkpointer` is given) are taken by the index stage, the only one that modifies the store.
+
+    Returns the per-stage timing stats (see `ingest_pipeline.StageStats`).
+    """
+
+    def prepare(batch):
+        documents = build_documents(batch)
+        texts = [doc.page_content for doc in documents]
+        metadatas = [doc.metadata for doc in documents]
+        hashes = compute_content_hashes(batch) if content_hashes is not None else None
+        return texts, metadatas, movie_ids(batch), hashes
+
+    def embed(prepared):
+        texts, metadatas, ids, hashes = prepared
+        return texts, embed_texts(texts, vector_store, embedding_cache=embedding_cache), metadatas, ids, hashes
+
+    def index(embedded):
+        texts, embeddings, metadatas, ids, hashes = embedded
+        vector_store.add_embeddings(zip(texts, embeddings), metadatas=metadatas, ids=ids)
+        if hashes is not None:
+            content_hashes.update(hashes)
+        if checkpointer is not None:
+            checkpointer.batch_done(vector_store, content_hashes)
+
+    def count_items(batch):
+        return len(batch[0]) if isinstance(batch, tuple) else len(batch)
+
+    with tqdm(total=total) as progress_bar:
+        stats = run_pipeline(movie_batches, [('prepare', prepare), ('embed', embed), ('index', index)],
+                             queue_size=queue_size, count_items=count_items, progress=progress_bar.update)
+
+    return stats
+
+
+def train_index_on_sample(movie_batches, vector_store, train_size=50_000, embedding_cache=None):
+    """
+    Train the vector store's index (if it needs training, e.g. IVF/PQ) on the embeddings of the first `train_size`
+    movies
+
+    The batches consumed for the sample are put back in front of the rest, so the returned iterable should be used
+    in place of `movie_batches`. Note that the sample is embedded twice (once for training and once when added),
+    unless an embedding cache is used.
+    """
+
+    if vector_store.index.is_trained:
+        return movie_batches
+
+    movie_batches = iter(movie_batches)
+    sample = []
+
+    for batch in movie_batches:
+        sample.append(batch)
+        if sum(len(b) for b in sample) >= train_size:
+            break
+
+    texts = [text for batch in sample for text in batch['plot_summary']]
+    embeddings = embed_texts(texts, vector_store, embedding_cache=embedding_cache)
+
+    vector_store.index.train(np.array(embeddings, dtype=np.float32))
+
+    return itertools.chain(sample, movie_batches)
+
+
+def update_vector_store(movie_batches, vector_store, content_hashes, batch_size=500, embedding_cache=None):
+    """
+    Incrementally bring an existing vector store up to date with a (new version of the) movie dataset
+
+    The content hash of every movie is compared against `content_hashes` (the hashes of the movies currently in the
+    store, which is updated in-place):
+        - movies that are new or whose summary/metadata changed are (re-)embedded and added
+        - movies that no longer exist in the dataset are removed from the index and the docstore
+        - unchanged movies are left untouched
+    Only the new/changed movies are buffered in memory, so this also works with `stream_movie_data`. Changed and
+    removed movies can only be updated in indexes that support removals (see `supports_removal`); otherwise a
+    ValueError is raised before the store is modified.
+    """
+
+    seen, to_add, to_delete = set(), [], []
+
+    for batch in tqdm(movie_batches, desc='Diffing'):
+
+        hashes = compute_content_hashes(batch)
+        seen.update(hashes)
+
+        to_delete += [movie_id for movie_id, h in hashes.items() if content_hashes.get(movie_id, h) != h]
+
+        is_modified = [content_hashes.get(movie_id) != h for movie_id, h in hashes.items()]
+        if any(is_modified):
+            to_add.append(batch[is_modified])
+
+    removed = [movie_id for movie_id in content_hashes if movie_id not in seen]
+    changes = {'added': sum(len(batch) for batch in to_add) - len(to_delete),
+               'updated': len(to_delete),
+               'deleted': len(removed)}
+
+    to_delete += removed
+    if to_delete and not supports_removal(vector_store.index):
+        raise ValueError(f'{len(to_delete)} movies changed or were removed, but vectors can\'t be removed from '
+                         f'{type(faiss.downcast_index(vector_store.index)).__name__} indexes; rebuild the index '
+                         f'without --update (or use a Flat, SQ or PQ --index-spec)')
+
+    if to_delete:
+        vector_store.delete(to_delete)  # removes the vectors from the index and the documents from the docstore
+        for movie_id in to_delete:
+            del content_hashes[movie_id]
+
+    if to_add:
+        populate_vector_store(pd.concat(to_add), vector_store, batch_size=batch_size,
+                              embedding_cache=embedding_cache, content_hashes=content_hashes)
+
+    changes['unchanged'] = len(seen) - changes['added'] - changes['updated']
+
+    return changes
+
+
+def save_vector_store(vector_store, save_dir, content_hashes):
+    """
+    Save the FAISS index and docstore, along with the content hashes of the movies (used by `update_vector_store`)
+    and the metadata indexes used for pre-filtering (see `metadata_index.MetadataIndex`)
+
+    The documents are also written in a format that can be memory-mapped without unpickling (see
+    `mmap_docstore.MmapDocstore`), which is what the search service uses, along with a manifest of the index (see
+    `index_manifest.write_manifest`).
+    """
+
+    if isinstance(vector_store.docstore, ColumnarDocstore):
+        vector_store.docstore.compact()  # drop the documents removed by `update_vector_store`
+
+    vector_store.save_local(save_dir)
+
+    MetadataIndex.build(vector_store).save(os.path.join(save_dir, 'metadata_index.npz'))
+
+    write_mmap_docstore(vector_store, save_dir)
+
+    write_manifest(vector_store, save_dir)
+
+    with open(os.path.join(save_dir, 'content_hashes.json'), 'w') as f:
+        json.dump(content_hashes, f)
+
+    remove_shards(save_dir)  # e.g. the index was sharded before, otherwise its (stale) shards would be loaded instead
+
+
+def save_sharded_vector_store(vector_store, save_dir, content_hashes, num_shards, quantized_index=None):
+    """
+    Save a vector store as `num_shards` independent shards, partitioned by id hash (see `sharded_index.iter_shards`)
+
+    Every shard is saved with `save_vector_store` (and `two_stage_index.save_quantized_index`, if `quantized_index` is
+    given) in its own directory, so it can be loaded and searched on its own (see `sharded_index.ShardedIndex`).
+    """
+
+    if isinstance(vector_store.docstore, ColumnarDocstore):
+        vector_store.docstore.compact()
+
+    os.makedirs(save_dir, exist_ok=True)
+
+    for shard, shard_store in enumerate(iter_shards(vector_store, num_shards)):
+
+        shard_hashes = {movie_id: content_hashes[movie_id]
+                        for movie_id in shard_store.index_to_docstore_id.values() if movie_id in content_hashes}
+
+        save_vector_store(shard_store, shard_dir(save_dir, shard), shard_hashes)
+
+        if quantized_index:
+            save_quantized_index(shard_store.index, shard_dir(save_dir, shard), index_spec=quantized_index)
+
+    write_manifest(vector_store, save_dir)
+
+    with open(os.path.join(save_dir, SHARDS_FILENAME), 'w') as f:
+        json.dump({'num_shards': num_shards}, f)
+
+    remove_shards(save_dir, keep=num_shards)  # leftovers of a previous save with more shards
+
+
+def load_vector_store(save_dir, embeddings=None):
+    """
+    Load a vector store saved with `save_vector_store`, along with the content hashes of its movies
+
+    Sharded vector stores (see `save_sharded_vector_store`) are merged back into a single one. Unless `embeddings`
+    are given, the embedding model the index was built with (as recorded in its manifest) is used.
+    """
+
+    if embeddings is None:
+        model_name = read_manifest(save_dir).get('model_name')
+        embeddings = HuggingFaceEmbeddings(model_name=model_name) if model_name else HuggingFaceEmbeddings()
+
+    if is_sharded(save_dir):
+        shards = [load_vector_store(shard_dir, embeddings) for shard_dir in shard_dirs(save_dir)]
+
+        vector_store = merge_shards([shard_store for shard_store, _ in shards])
+        content_hashes = {movie_id: h for _, shard_hashes in shards for movie_id, h in shard_hashes.items()}
+
+        return vector_store, content_hashes
+
+    vector_store = FAISS.load_local(save_dir, embeddings, allow_dangerous_deserialization=True)
+
+    hashes_path = os.path.join(save_dir, 'content_hashes.json')
+
+    if not os.path.isfile(hashes_path):
+        raise FileNotFoundError(f'No content hashes found under {save_dir}; rebuild the index before updating it')
+
+    with open(hashes_path) as f:
+        content_hashes = json.load(f)
+
+    return vector_store, content_hashes
 
-        add_batch_to_vector_store(movies[i:i+BATCH_SIZE], vector_store)
-        
 
-        
 if __name__ == '__main__':
-    BATCH_SIZE = 500
-    FAISS_SAVE_DIR = 'movie_faiss'
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--batch-size', type=int, required=False, default=500,
+                        help='Number of movies embedded and added to the vector store at a time')
+    parser.add_argument('--save-dir', type=str, required=False, default='movie_faiss',
+                        help='Directory under which the FAISS index will be saved')
+    parser.add_argument('--streaming', action='store_true',
+                        help='Stream the summaries in batches instead of loading the whole dataset in memory')
+    parser.add_argument('--table-cache-dir', type=str, required=False, default='movie_cache',
+                        help='Directory where the preprocessed movie table is cached (in parquet format)')
+    parser.add_argument('--no-table-cache', action='store_true',
+                        help="Don't use the cache of the preprocessed movie table (always preprocess the raw data)")
+    parser.add_argument('--pipelined', action='store_true',
+                        help='Overlap document building, embedding and indexing of consecutive batches')
+    parser.add_argument('--queue-size', type=int, required=False, default=2,
+                        help='Max number of batches buffered between two pipeline stages (with --pipelined)')
+    parser.add_argument('--embedding-cache-dir', type=str, required=False, default=None,
+                        help='Directory of a persistent embedding cache; only summaries missing from it are embedded')
+    parser.add_argument('--embedding-cache-size', type=int, required=False, default=1_000_000,
+                        help='Max number of embeddings kept in the cache (least recently used ones are evicted)')
+    parser.add_argument('--update', action='store_true',
+                        help='Update the index under --save-dir in place, only embedding new/changed movies')
+    parser.add_argument('--embedding-workers', type=int, required=False, default=1,
+                        help='Number of worker processes (each with its own copy of the model) used for embedding')
+    parser.add_argument('--threads-per-worker', type=int, required=False, default=1,
+                        help='Number of threads each embedding worker process is allowed to use')
+    parser.add_argument('--index-spec', type=str, required=False, default='Flat',
+                        help="FAISS index factory spec, e.g. 'Flat', 'IVF1024,Flat', 'IVF1024,PQ64' or 'HNSW32'")
+    parser.add_argument('--quantized-index', type=str, required=False, default=None,
+                        help="Also save a quantized copy of the index (e.g. 'SQ8') and the raw float32 vectors, "
+                             "for two-stage search (see two_stage_index.py)")
+    parser.add_argument('--train-size', type=int, required=False, default=50_000,
+                        help='Number of movies whose embeddings are used to train IVF/PQ indexes')
+    parser.add_argument('--embedding-model', type=str, required=False,
+                        default='sentence-transformers/all-mpnet-base-v2',
+                        help="Sentence-transformers model used for the embeddings, e.g. a smaller one like "
+                             "'sentence-transformers/all-MiniLM-L6-v2' (384 dims)")
+    parser.add_argument('--projection', type=str, required=False, default=None,
+                        help="Reduce the embeddings with a learned projection stored in the index, e.g. 'PCA256' or "
+                             "'OPQ16_128' (see benchmark_embeddings.py to compare the options)")
+    parser.add_argument('--num-shards', type=int, required=False, default=None,
+                        help='Save the index as this many shards, partitioned by movie id hash (see sharded_index.py); '
+                             'defaults to 1, or with --update to the number of shards of the existing index')
+    parser.add_argument('--checkpoint-dir', type=str, required=False, default=None,
+                        help='Periodically checkpoint the vector store under this directory and resume from the last '
+                             'checkpoint if one exists (removed once the vector store is saved)')
+    parser.add_argument('--checkpoint-every-batches', type=int, required=False, default=None,
+                        help='Checkpoint after this many batches (with --checkpoint-dir)')
+    parser.add_argument('--checkpoint-every-seconds', type=float, required=False, default=600,
+                        help='Checkpoint when this many seconds have passed since the last one (with --checkpoint-dir)')
+
+    args = parser.parse_args()
 
     print('Downloading CMU movie data...')
     download_and_extract_movie_dataset()
-    
-    print('Loading and preprocessing data...')
-    movies = load_and_preprocess_movie_data()
-    
-    print(f'Loaded {len(movies)} movies')
-    print('Features:', movies.columns)
-    
-    vector_store = init_faiss()
-    
-    print('Created FAISS vector store')
+
+    num_shards = args.num_shards or (num_shards_of(args.save_dir) if args.update else 1)
+
+    if args.update:
+        vector_store, content_hashes = load_vector_store(args.save_dir)
+        print(f'Loaded FAISS vector store from {args.save_dir} ({vector_store.index.ntotal} vectors)')
+    else:
+        vector_store = init_faiss(index_spec=projected_index_spec(args.index_spec, args.projection),
+                                  embeddings=HuggingFaceEmbeddings(model_name=args.embedding_model))
+        content_hashes = {}
+        print('Created FAISS vector store')
+
+    checkpointer = None
+    if args.checkpoint_dir and not args.update:
+        # batches are only reproduced in the same order with the same batch size and data source
+        checkpointer = IngestCheckpointer(args.checkpoint_dir,
+                                          every_batches=args.checkpoint_every_batches,
+                                          every_seconds=args.checkpoint_every_seconds,
+                                          config={'batch_size': args.batch_size, 'streaming': args.streaming,
+                                                  'index_spec': args.index_spec, 'projection': args.projection,
+                                                  'embedding_model': args.embedding_model})
+        restored = checkpointer.restore(vector_store.embedding_function)
+        if restored is not None:
+            vector_store, content_hashes = restored
+            print(f'Resuming from checkpoint under {args.checkpoint_dir} '
+                  f'({checkpointer.batches_done} batches, {vector_store.index.ntotal} vectors)')
+
     print(' |_ Embedding model:', vector_store.embedding_function.model_name)
     print(' |_ Embeddings dim:', vector_store.index.d)
-    
-    print(f'Populating vector store in batches of {BATCH_SIZE}...')
-    populate_vector_store(movies, vector_store, batch_size=BATCH_SIZE)
+    print(' |_ Index type:', type(faiss.downcast_index(vector_store.index)).__name__)
+
+    embedding_cache = None
+    if args.embedding_cache_dir:
+        embedding_cache = EmbeddingCache(args.embedding_cache_dir, vector_store.embedding_function.model_name,
+                                         vector_store.index.d, max_entries=args.embedding_cache_size)
+        print(f'Using embedding cache under {args.embedding_cache_dir} ({len(embedding_cache)} entries)')
+        if checkpointer is not None:
+            checkpointer.on_save = embedding_cache.save
+
+    if args.embedding_workers > 1:
+        print(f'Embedding with {args.embedding_workers} worker processes ({args.threads_per_worker} threads each)')
+        embeddings = vector_store.embedding_function
+        vector_store.embedding_function = MultiProcessEmbeddings(embeddings.model_name,
+                                                                 num_workers=args.embedding_workers,
+                                                                 threads_per_worker=args.threads_per_worker)
+
+    if args.streaming:
+        print('Loading metadata lookup...')
+        metadata_lookup = load_metadata_lookup()
+
+        print(f'Streaming summaries into the vector store in batches of {args.batch_size}...')
+        movie_batches = stream_movie_data(batch_size=args.batch_size, metadata_lookup=metadata_lookup)
+        num_batches = None
+
+    else:
+        print('Loading and preprocessing data...')
+        if args.no_table_cache:
+            movies = load_and_preprocess_movie_data()
+        else:
+            movies = load_and_preprocess_movie_data_cached(cache_dir=args.table_cache_dir)
+
+        print(f'Loaded {len(movies)} movies')
+        print('Features:', movies.columns)
+
+        print(f'Populating vector store in batches of {args.batch_size}...')
+        movie_batches = iter_movie_batches(movies, batch_size=args.batch_size)
+        num_batches = -(-len(movies) // args.batch_size)
+
+    if checkpointer is not None and checkpointer.batches_done:
+        movie_batches = checkpointer.skip_done(movie_batches)
+        num_batches = num_batches and num_batches - checkpointer.batches_done
+
+    if not vector_store.index.is_trained:
+        index_spec = projected_index_spec(args.index_spec, args.projection)
+        print(f'Training {index_spec} index on {args.train_size} movies...')
+        movie_batches = train_index_on_sample(movie_batches, vector_store, train_size=args.train_size,
+                                              embedding_cache=embedding_cache)
+
+    if args.update:
+        changes = update_vector_store(movie_batches, vector_store, content_hashes, batch_size=args.batch_size,
+                                      embedding_cache=embedding_cache)
+        print('Changes:', changes)
+    elif args.pipelined:
+        stage_stats = populate_vector_store_pipelined(movie_batches, vector_store, queue_size=args.queue_size,
+                                                      total=num_batches, embedding_cache=embedding_cache,
+                                                      content_hashes=content_hashes, checkpointer=checkpointer)
+        print('Pipeline stats:')
+        for stats in stage_stats:
+            print(' |_', stats)
+    else:
+        populate_vector_store_from_batches(movie_batches, vector_store, total=num_batches,
+                                           embedding_cache=embedding_cache, content_hashes=content_hashes,
+                                           checkpointer=checkpointer)
+
+    if embedding_cache is not None:
+        embedding_cache.save()
+        print('Embedding cache stats:', embedding_cache.stats())
+
+    if args.embedding_workers > 1:
+        vector_store.embedding_function.close()
+        vector_store.embedding_function = embeddings
 
     print(f'Vectors indexed in FAISS: {vector_store.index.ntotal}')
-    
-    print('Saving FAISS index under:', FAISS_SAVE_DIR)
-    vector_store.save_local(FAISS_SAVE_DIR)
+
+    if num_shards > 1:
+        print(f'Saving FAISS index in {num_shards} shards under:', args.save_dir)
+        save_sharded_vector_store(vector_store, args.save_dir, content_hashes, num_shards=num_shards,
+                                  quantized_index=args.quantized_index)
+    else:
+        print('Saving FAISS index under:', args.save_dir)
+        save_vector_store(vector_store, args.save_dir, content_hashes)
+
+    if args.quantized_index and num_shards <= 1:
+        print(f'Saving {args.quantized_index} index and float32 vectors for two-stage search...')
+        save_quantized_index(vector_store.index, args.save_dir, index_spec=args.quantized_index)
+
+    if checkpointer is not None:
+        checkpointer.clear()
@@ -0,0 +1,190 @@
+import os
+import time
+
+_start = time.perf_counter()
+
+import faiss
+from typing import List, Optional
+from fastapi import FastAPI, HTTPException, Response
+from pydantic import BaseModel, Field
+
+from background_embeddings import BackgroundEmbeddings
+from index_manifest import read_manifest
+from metadata_index import MetadataIndex
+from mmap_docstore import MmapDocstore
+from movie_search import MovieSearcher, SemanticResultCache
+from search_params import set_search_params
+from sharded_index import ShardedDocuments, ShardedIndex, ShardedMetadataIndex, is_sharded, shard_dirs
+from two_stage_index import load_two_stage_index
+
+
+FAISS_DIR = os.environ.get('MOVIE_FAISS_DIR', 'movie_faiss')
+# the model the index was built with (from its manifest) is used by default
+EMBEDDING_MODEL = (os.environ.get('EMBEDDING_MODEL') or read_manifest(FAISS_DIR).get('model_name')
+                   or 'sentence-transformers/all-mpnet-base-v2')
+QUANTIZED_INDEX = os.environ.get('QUANTIZED_INDEX')  # e.g. 'SQ8', to use two-stage search (see two_stage_index.py)
+RERANK_FACTOR = int(os.environ.get('RERANK_FACTOR', 4))
+NPROBE = int(os.environ.get('NPROBE', 16))  # clusters visited per query by IVF indexes (see benchmark_index.py)
+EF_SEARCH = int(os.environ.get('EF_SEARCH', 64))  # size of the candidate list of HNSW indexes
+MAX_K = int(os.environ.get('MAX_K', 100))  # largest k a request can ask for
+RESULT_CACHE_SIZE = int(os.environ.get('RESULT_CACHE_SIZE', 0))  # > 0 to cache results of near-duplicate queries
+RESULT_CACHE_THRESHOLD = float(os.environ.get('RESULT_CACHE_THRESHOLD', 0.95))  # min cosine similarity for a hit
+RESULT_CACHE_TTL = float(os.environ.get('RESULT_CACHE_TTL', 3600))  # seconds
+
+
+def load_index_mmap(index_dir):
+    """
+    Load a FAISS index memory-mapped (read-only) instead of reading it in RAM
+
+    The OS loads its pages lazily and shares them between all processes that map the same file, so every uvicorn
+    worker doesn't need its own copy of the vectors. Indexes that FAISS can't map (e.g. IVF ones, whose inverted lists
+    are read with the rest of the file) are read in RAM instead.
+    """
+
+    path = os.path.join(index_dir, 'index.faiss')
+    flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY | getattr(faiss, 'IO_FLAG_MMAP_IFC', 0)  # faiss>=1.11 for flat
+
+    try:
+        return faiss.read_index(path, flags)
+    except RuntimeError as e:
+        print(f'Could not memory-map {path}, reading it in RAM: {e}')
+        return faiss.read_index(path)
+
+
+def load_index(index_dir):
+
+    if QUANTIZED_INDEX:
+        return load_two_stage_index(index_dir, index_spec=QUANTIZED_INDEX, rerank_factor=RERANK_FACTOR)
+
+    index = load_index_mmap(index_dir)
+    set_search_params(index, nprobe=NPROBE, ef_search=EF_SEARCH)  # not saved with the index
+
+    return index
+
+
+def load_metadata_index(index_dir):
+    return MetadataIndex.load(os.path.join(index_dir, 'metadata_index.npz'))
+
+
+app = FastAPI()
+
+startup = {'imports_sec': round(time.perf_counter() - _start, 3)}  # startup time breakdown, reported by /health
+
+# the model loads in the background while the index, docstore and metadata index are mapped in
+embeddings = BackgroundEmbeddings(EMBEDDING_MODEL)
+
+start = time.perf_counter()
+if is_sharded(FAISS_DIR):  # shards are searched in parallel and their results merged (see sharded_index.py)
+    dirs = shard_dirs(FAISS_DIR)
+    index = ShardedIndex([load_index(shard_dir) for shard_dir in dirs])
+    documents = ShardedDocuments([MmapDocstore(shard_dir) for shard_dir in dirs], index.offsets)
+    metadata_index = ShardedMetadataIndex([load_metadata_index(shard_dir) for shard_dir in dirs], index.offsets)
+else:
+    index = load_index(FAISS_DIR)
+    documents = MmapDocstore(FAISS_DIR)
+    metadata_index = load_metadata_index(FAISS_DIR)
+startup['index_load_sec'] = round(time.perf_counter() - start, 3)
+
+result_cache = None
+if RESULT_CACHE_SIZE > 0:
+    result_cache = SemanticResultCache(max_size=RESULT_CACHE_SIZE, threshold=RESULT_CACHE_THRESHOLD,
+                                       ttl=RESULT_CACHE_TTL)
+
+searcher = MovieSearcher(index, embeddings, documents, metadata_index=metadata_index, result_cache=result_cache)
+startup['total_sec'] = round(time.perf_counter() - _start, 3)  # the model may still be loading
+
+print('Startup:', startup)
+
+
+class SearchRequest(BaseModel):
+    query: str
+    k: int = Field(4, gt=0, le=MAX_K)
+    filter: Optional[dict] = None  # declarative metadata filter, e.g. {'actors': 'Tom Cruise'}
+
+
+class BatchSearchRequest(BaseModel):
+    queries: List[str]
+    k: int = Field(4, gt=0, le=MAX_K)
+
+
+def _check_model_ready():
+    """
+    Queries can't be embedded until the model is loaded: same 503 as /health instead of a failed request
+    """
+
+    if not embeddings.is_ready():
+        raise HTTPException(status_code=503, detail=f'Embedding model {EMBEDDING_MODEL} is not ready',
+                            headers={'Retry-After': '5'})
+
+
+def _format_results(results):
+    return [{'id': doc.id,
+             'name': doc.metadata.get('name'),
+             'distance': distance,
+             'plot_summary': doc.page_content,
+             'metadata': doc.metadata}
+            for doc, distance in results]
+
+
+@app.get('/')
+def root():
+    """
+    Root endpoint
+    """
+    return {'message': 'Welcome to the movie semantic search service!',
+            'num_vectors': searcher.index.ntotal,
+            'dim': searcher.index.d}
+
+
+@app.get('/health')
+def health(response: Response):
+    """
+    Readiness check: 503 until the embedding model is loaded; also reports the startup time breakdown
+    """
+
+    if not embeddings.is_ready():
+        response.status_code = 503
+
+    return {'ready': embeddings.is_ready(),
+            'embedding_model': EMBEDDING_MODEL,
+            'startup': {**startup, **embeddings.timings}}
+
+
+@app.get('/stats')
+def stats():
+    """
+    Hit rates of the query embedding cache and the result cache (if enabled)
+    """
+
+    return {'query_cache': searcher.query_cache.stats(),
+            'result_cache': result_cache.stats() if result_cache is not None else None}
+
+
+@app.post('/search')
+def search(request: SearchRequest):
+    """
+    Search for the k movies most similar to a query, optionally restricted to the ones that satisfy a filter
+    """
+
+    _check_model_ready()
+
+    if request.filter:
+        try:
+            results = searcher.filtered_search(request.query, request.filter, k=request.k)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    else:
+        results = searcher.search([request.query], k=request.k)[0]
+
+    return {'results': _format_results(results)}
+
+
+@app.post('/search/batch')
+def search_batch(request: BatchSearchRequest):
+    """
+    Search for many queries at once (embedded and searched in a single batch)
+    """
+
+    _check_model_ready()
+
+    return {'results': [_format_results(results) for results in searcher.search(request.queries, k=request.k)]}
@@ -0,0 +1,16 @@
+import faiss
+
+
+def set_search_params(index, nprobe=None, ef_search=None):
+    """
+    Set the speed/accuracy knobs of approximate indexes: `nprobe` (clusters visited) for IVF indexes and `ef_search`
+    (size of the candidate list) for HNSW indexes. Parameters that don't apply to the index are ignored.
+    """
+
+    params = faiss.ParameterSpace()
+
+    if nprobe is not None and faiss.try_extract_index_ivf(index) is not None:
+        params.set_index_parameter(index, 'nprobe', nprobe)
+
+    if ef_search is not None and hasattr(faiss.downcast_index(index), 'hnsw'):
+        params.set_index_parameter(index, 'efSearch', ef_search)
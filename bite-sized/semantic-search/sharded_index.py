@@ -0,0 +1,270 @@
+import os
+import json
+import zlib
+import faiss
+import shutil
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+from metadata_index import search_positions
+
+
+SHARDS_FILENAME = 'shards.json'
+
+
+def shard_of(movie_id, num_shards):
+    """
+    Shard a movie belongs to, from a hash of its id (stable across processes, unlike python's `hash`)
+    """
+
+    return zlib.crc32(str(movie_id).encode('utf-8')) % num_shards
+
+
+def shard_dir(save_dir, shard):
+    return os.path.join(save_dir, f'shard-{shard:03d}')
+
+
+def shard_dirs(save_dir):
+    """
+    Directories of the shards of an index saved with `populate_movie_faiss.save_sharded_vector_store`
+    """
+
+    return [shard_dir(save_dir, shard) for shard in range(num_shards_of(save_dir))]
+
+
+def is_sharded(save_dir):
+    return os.path.isfile(os.path.join(save_dir, SHARDS_FILENAME))
+
+
+def num_shards_of(save_dir):
+    """
+    Number of shards of a saved index (1 if it isn't sharded)
+    """
+
+    if not is_sharded(save_dir):
+        return 1
+
+    with open(os.path.join(save_dir, SHARDS_FILENAME)) as f:
+        return json.load(f)['num_shards']
+
+
+def remove_shards(save_dir, keep=0):
+    """
+    Remove the shard directories of a saved index beyond the first `keep` ones; with `keep=0`, the index is no longer
+    sharded, so `shards.json` is removed first (loaders then read the unsharded index saved in `save_dir` itself)
+    """
+
+    if keep == 0 and is_sharded(save_dir):
+        os.remove(os.path.join(save_dir, SHARDS_FILENAME))
+
+    for name in os.listdir(save_dir):
+        if name.startswith('shard-') and name[len('shard-'):].isdigit() and int(name[len('shard-'):]) >= keep:
+            shutil.rmtree(os.path.join(save_dir, name), ignore_errors=True)
+
+
+def iter_shards(vector_store, num_shards, chunk_size=100_000):
+    """
+    Partition a vector store by id hash into `num_shards` independent vector stores, yielded one at a time
+
+    Every shard gets an empty copy of the store's index, so trained indexes (IVF, PQ) keep their centroids and codebooks
+    and a shard is searched exactly like the corresponding part of the full index. Vectors are copied in chunks.
+    """
+
+    # imported here rather than at the top, as the search service only needs the search side of this module
+    from langchain_community.vectorstores import FAISS
+    from columnar_docstore import ColumnarDocstore
+
+    index = vector_store.index
+
+    if faiss.try_extract_index_ivf(index) is not None:
+        faiss.extract_index_ivf(index).make_direct_map()  # IVF indexes need it to reconstruct vectors by position
+
+    assignments = np.array([shard_of(vector_store.index_to_docstore_id[position], num_shards)
+                            for position in range(index.ntotal)], dtype=np.int64)
+
+    for shard in range(num_shards):
+
+        positions = np.flatnonzero(assignments == shard)
+
+        shard_index = faiss.clone_index(index)
+        shard_index.reset()
+
+        for start in range(0, len(positions), chunk_size):
+            shard_index.add(index.reconstruct_batch(positions[start:start + chunk_size]))
+
+        doc_ids = [vector_store.index_to_docstore_id[position] for position in positions]
+
+        docstore = ColumnarDocstore()
+        docstore.add({doc_id: vector_store.docstore.search(doc_id) for doc_id in doc_ids})
+
+        yield FAISS(embedding_function=vector_store.embedding_function, index=shard_index, docstore=docstore,
+                    index_to_docstore_id=dict(enumerate(doc_ids)))
+
+
+def _has_merge_from(index):
+    """
+    Whether FAISS can merge another index of the same kind into this one (HNSW indexes, for one, can't)
+    """
+
+    index = faiss.downcast_index(index)
+
+    if isinstance(index, faiss.IndexPreTransform):
+        return _has_merge_from(index.index)
+
+    return isinstance(index, (faiss.IndexFlatCodes, faiss.IndexIVF))
+
+
+def merge_shards(shard_stores, chunk_size=100_000):
+    """
+    Merge shard vector stores (e.g. the shards of a saved index) back into a single vector store, in shard order
+
+    Indexes that FAISS can't merge (e.g. HNSW) get the vectors of the other shards re-added instead, which rebuilds
+    their part of the graph.
+    """
+
+    vector_store = shard_stores[0]
+
+    for shard_store in shard_stores[1:]:
+
+        offset = vector_store.index.ntotal
+
+        # unlike `FAISS.merge_from`, this also works for IVF indexes, which store their ids (so they need to be offset)
+        # and can't be merged while they have a direct map
+        if faiss.try_extract_index_ivf(vector_store.index) is not None:
+            for index in (vector_store.index, shard_store.index):
+                faiss.extract_index_ivf(index).set_direct_map_type(faiss.DirectMap.NoMap)
+            vector_store.index.merge_from(shard_store.index, offset)
+        elif _has_merge_from(vector_store.index):
+            vector_store.index.merge_from(shard_store.index)
+        else:
+            for start in range(0, shard_store.index.ntotal, chunk_size):
+                num_vectors = min(chunk_size, shard_store.index.ntotal - start)
+                vector_store.index.add(shard_store.index.reconstruct_n(start, num_vectors))
+
+        vector_store.docstore.add({doc_id: shard_store.docstore.search(doc_id)
+                                   for doc_id in shard_store.index_to_docstore_id.values()})
+        vector_store.index_to_docstore_id.update({offset + position: doc_id
+                                                  for position, doc_id in shard_store.index_to_docstore_id.items()})
+
+    return vector_store
+
+
+def merge_top_k(distances, positions, k):
+    """
+    Merge per-shard results, given side by side as (num_queries, num_shards * k) arrays, into a global top-k
+    """
+
+    distances = np.where(positions >= 0, distances, np.inf)
+    top = np.argsort(distances, axis=1, kind='stable')[:, :k]
+
+    distances, positions = np.take_along_axis(distances, top, axis=1), np.take_along_axis(positions, top, axis=1)
+
+    return distances.astype(np.float32), np.where(np.isinf(distances), -1, positions)
+
+
+class ShardedIndex:
+    """
+    Searches a list of index shards in parallel (one thread per shard, FAISS releases the GIL while searching) and
+    merges their top-k into a global top-k
+
+    Positions are global: the positions of shard i come after those of shards 0..i-1. Quacks like a FAISS index
+    (`search`, `reconstruct_batch`, `ntotal`, `d`), so it can be used by `movie_search.MovieSearcher` in place of one.
+    The shards can be FAISS indexes or anything that quacks like one (e.g. `two_stage_index.TwoStageIndex`).
+    """
+
+    def __init__(self, shards, max_workers=None):
+        self.shards = shards
+        self.offsets = np.cumsum([0] + [shard.ntotal for shard in shards])
+        self._executor = ThreadPoolExecutor(max_workers=max_workers or len(shards))
+
+    @property
+    def ntotal(self):
+        return int(self.offsets[-1])
+
+    @property
+    def d(self):
+        return self.shards[0].d
+
+    def _split(self, positions):
+        """
+        Split sorted global positions into the local positions of each shard
+        """
+
+        bounds = np.searchsorted(positions, self.offsets)
+
+        return [positions[bounds[i]:bounds[i + 1]] - self.offsets[i] for i in range(len(self.shards))]
+
+    def reconstruct_batch(self, positions):
+
+        positions = np.asarray(positions, dtype=np.int64)
+        shard_ids = np.searchsorted(self.offsets, positions, side='right') - 1
+
+        vectors = np.empty((len(positions), self.d), dtype=np.float32)
+        for shard_id in np.unique(shard_ids):
+            mask = shard_ids == shard_id
+            vectors[mask] = self.shards[shard_id].reconstruct_batch(positions[mask] - self.offsets[shard_id])
+
+        return vectors
+
+    def search(self, queries, k, params=None):
+
+        if params is not None:
+            raise ValueError('Search parameters are not supported across shards; see `search_positions`')
+
+        queries = np.asarray(queries, dtype=np.float32)
+
+        results = list(self._executor.map(lambda shard: shard.search(queries, k), self.shards))
+
+        distances = np.hstack([shard_distances for shard_distances, _ in results])
+        positions = np.hstack([np.where(shard_positions >= 0, shard_positions + offset, -1)
+                               for (_, shard_positions), offset in zip(results, self.offsets)])
+
+        return merge_top_k(distances, positions, k)
+
+    def search_positions(self, query_vector, positions, k=4, exact_threshold=20_000):
+        """
+        Sharded version of `metadata_index.search_positions`: every shard is searched among its own positions
+        """
+
+        local_positions = self._split(np.sort(np.asarray(positions, dtype=np.int64)))
+
+        def _search(shard_id):
+            distances, found = search_positions(self.shards[shard_id], query_vector, local_positions[shard_id], k=k,
+                                                exact_threshold=exact_threshold)
+            return distances, found + self.offsets[shard_id]
+
+        results = list(self._executor.map(_search, range(len(self.shards))))
+
+        distances = np.concatenate([distances for distances, _ in results])
+        found = np.concatenate([found for _, found in results]).astype(np.int64)
+        top = np.argsort(distances, kind='stable')[:k]
+
+        return distances[top], found[top]
+
+
+class ShardedDocuments:
+    """
+    Look up documents by global position in the per-shard docstores (e.g. `mmap_docstore.MmapDocstore`)
+    """
+
+    def __init__(self, documents, offsets):
+        self.documents = documents
+        self.offsets = offsets
+
+    def get(self, position):
+        shard_id = np.searchsorted(self.offsets, position, side='right') - 1
+        return self.documents[shard_id].get(position - self.offsets[shard_id])
+
+
+class ShardedMetadataIndex:
+    """
+    Resolves metadata filters against the per-shard `metadata_index.MetadataIndex`es, in global positions
+    """
+
+    def __init__(self, metadata_indexes, offsets):
+        self.metadata_indexes = metadata_indexes
+        self.offsets = offsets
+
+    def resolve(self, filter):
+        return np.concatenate([metadata_index.resolve(filter) + offset
+                               for metadata_index, offset in zip(self.metadata_indexes, self.offsets)])
@@ -0,0 +1,117 @@
+import os
+import json
+import zlib
+import random
+import argparse
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+WORDS = ('a young man woman family town war love police ship crew planet city school friend father mother son '
+         'daughter gang money heist murder detective journey king queen army village secret island doctor band '
+         'music dream night escape prison soldier robot alien time world life death home train story').split()
+
+LANGUAGES = ['English Language', 'French Language', 'Hindi Language', 'Spanish Language', 'Italian Language',
+             'German Language', 'Japanese Language', 'Tamil Language', 'Silent film', 'Mandarin Chinese']
+COUNTRIES = ['United States of America', 'India', 'United Kingdom', 'France', 'Italy', 'Japan', 'Canada', 'Germany',
+             'Argentina', 'Hong Kong']
+GENRES = ['Drama', 'Comedy', 'Romance Film', 'Thriller', 'Action', 'World cinema', 'Crime Fiction', 'Horror',
+          'Black-and-white', 'Indie', 'Action/Adventure', 'Science Fiction', 'Short Film', 'Family Film', 'War film',
+          'Musical', 'Animation', 'Documentary', 'Western', 'Space opera']
+
+
+def _freebase_dict(values):
+    """
+    Format values the way the CMU dataset does, e.g. '{"/m/02h40lc": "English Language"}'
+    """
+
+    return json.dumps({f'/m/0{zlib.crc32(value.encode()):x}': value for value in values})
+
+
+def generate_movie_dataset(movie_dataset_dir, num_movies, seed=0, summary_words=(20, 300), num_actors=50_000,
+                           metadata_only_fraction=0.5):
+    """
+    Write a synthetic movie dataset with the same files and format as the CMU Movie Summary Corpus (plot_summaries.txt,
+    movie.metadata.tsv, character.metadata.tsv), so it can be loaded by the same functions as the real one
+
+    The merged table (see `populate_movie_faiss.load_and_preprocess_movie_data`) has `num_movies` rows. As in the real
+    dataset, some movies only have metadata (`metadata_only_fraction` extra rows), some values are missing and the
+    release dates have mixed formats. Files are written line by line, so any size fits in memory.
+    """
+
+    rng = random.Random(seed)
+    os.makedirs(movie_dataset_dir, exist_ok=True)
+
+    num_metadata_only = int(num_movies * metadata_only_fraction)
+
+    with open(os.path.join(movie_dataset_dir, 'plot_summaries.txt'), 'w', encoding='utf-8') as summaries, \
+            open(os.path.join(movie_dataset_dir, 'movie.metadata.tsv'), 'w', encoding='utf-8') as metadata, \
+            open(os.path.join(movie_dataset_dir, 'character.metadata.tsv'), 'w', encoding='utf-8') as characters:
+
+        for i in range(num_movies + num_metadata_only):
+
+            wikipedia_id = 100_000 + i
+            freebase_id = f'/m/0{i:x}'
+
+            if i < num_movies:
+                summary = ' '.join(rng.choices(WORDS, k=rng.randint(*summary_words)))
+                summaries.write(f'{wikipedia_id}\t{summary.capitalize()}.\n')
+
+            year = rng.randint(1910, 2015)
+            release_date = rng.choice([f'{year}', f'{year}-{rng.randint(1, 12):02d}',
+                                       f'{year}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}', ''])
+            box_office = str(rng.randint(10_000, 500_000_000)) if rng.random() < 0.1 else ''
+            runtime = f'{rng.randint(5, 200)}.0' if rng.random() < 0.75 else ''
+
+            metadata.write('\t'.join([str(wikipedia_id), freebase_id, ' '.join(rng.choices(WORDS, k=2)).title(),
+                                      release_date, box_office, runtime,
+                                      _freebase_dict(rng.sample(LANGUAGES, rng.randint(0, 2))),
+                                      _freebase_dict(rng.sample(COUNTRIES, rng.randint(0, 2))),
+                                      _freebase_dict(rng.sample(GENRES, rng.randint(0, 4)))]) + '\n')
+
+            for _ in range(rng.randint(0, 8)):
+                actor = rng.randrange(num_actors)
+                characters.write('\t'.join([str(wikipedia_id), freebase_id, release_date, f'Character {actor}',
+                                            '', rng.choice(['M', 'F']), '', '', f'Actor {actor}', '',
+                                            f'/m/0c{actor:x}', f'/m/0d{actor:x}', f'/m/0a{actor:x}']) + '\n')
+
+
+class StubEmbeddings(Embeddings):
+    """
+    Deterministic stand-in for an embedding model: every text is mapped to a fixed pseudo-random unit vector seeded
+    by its hash
+
+    It costs next to nothing, so benchmarks that use it measure the cost of everything but the model (and they run
+    offline, without downloading one).
+    """
+
+    def __init__(self, dim=768, model_name='stub'):
+        self.dim = dim
+        self.model_name = model_name
+
+    def _embed(self, text):
+        vector = np.random.default_rng(zlib.crc32(text.encode('utf-8'))).standard_normal(self.dim)
+        return (vector / np.linalg.norm(vector)).astype(np.float32).tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--output-dir', type=str, required=False, default='SyntheticMovieSummaries',
+                        help='Directory where the dataset files are written')
+    parser.add_argument('--num-movies', type=int, required=False, default=10_000,
+                        help='Number of movies (with a summary) in the dataset')
+    parser.add_argument('--seed', type=int, required=False, default=0,
+                        help='Random seed; the same seed and size always produce the same files')
+
+    args = parser.parse_args()
+
+    generate_movie_dataset(args.output_dir, args.num_movies, seed=args.seed)
+    print(f'Wrote a synthetic dataset of {args.num_movies} movies under {args.output_dir}')
@@ -0,0 +1,149 @@
+import io
+import os
+import hashlib
+import tarfile
+import threading
+import numpy as np
+import pytest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from populate_movie_faiss import download_and_extract_movie_dataset
+
+FILES = ('plot_summaries.txt', 'movie.metadata.tsv')
+
+
+def make_archive():
+    """
+    A small MovieSummaries.tar.gz: the files we extract, one we don't, and random bytes so that it doesn't compress
+    """
+
+    rng = np.random.default_rng(0)
+    contents = {name: rng.bytes(200_000) for name in FILES + ('name.clusters.txt',)}
+
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:gz') as tar:
+        for name, data in contents.items():
+            info = tarfile.TarInfo(f'MovieSummaries/{name}')
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+    return buffer.getvalue(), contents
+
+
+ARCHIVE, CONTENTS = make_archive()
+ARCHIVE_SHA256 = hashlib.sha256(ARCHIVE).hexdigest()
+
+
+class ArchiveHandler(BaseHTTPRequestHandler):
+    """
+    Serves ARCHIVE at any path, honoring `Range: bytes=<start>-` requests (unlike http.server's file handler)
+    """
+
+    requests = []  # Range header of every request ('' if none)
+
+    def do_GET(self):
+
+        range_header = self.headers.get('Range', '')
+        self.requests.append(range_header)
+
+        start = int(range_header[len('bytes='):].rstrip('-')) if range_header else 0
+
+        self.send_response(206 if range_header else 200)
+        if range_header:
+            self.send_header('Content-Range', f'bytes {start}-{len(ARCHIVE) - 1}/{len(ARCHIVE)}')
+        self.send_header('Content-Length', str(len(ARCHIVE) - start))
+        self.end_headers()
+        self.wfile.write(ARCHIVE[start:])
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+
+    ArchiveHandler.requests = []
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), ArchiveHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+
+    yield f'http://127.0.0.1:{httpd.server_port}/MovieSummaries.tar.gz'
+
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def download(url, tmp_path, **kwargs):
+    download_and_extract_movie_dataset(url, archive_path=str(tmp_path / 'MovieSummaries.tar.gz'),
+                                       extract_dir=str(tmp_path), files=FILES, chunk_size=4096, **kwargs)
+
+
+def assert_extracted(tmp_path):
+
+    assert sorted(os.listdir(tmp_path / 'MovieSummaries')) == sorted(FILES)  # only the files we asked for
+
+    for name in FILES:
+        assert (tmp_path / 'MovieSummaries' / name).read_bytes() == CONTENTS[name]
+
+
+def test_full_download(server, tmp_path):
+
+    download(server, tmp_path, sha256=ARCHIVE_SHA256)
+
+    assert ArchiveHandler.requests == ['']
+    assert_extracted(tmp_path)
+    assert (tmp_path / 'MovieSummaries.tar.gz').read_bytes() == ARCHIVE
+    assert (tmp_path / 'MovieSummaries.tar.gz.sha256').read_text() == ARCHIVE_SHA256
+    assert not (tmp_path / 'MovieSummaries.tar.gz.part').exists()
+
+
+def test_skips_verified_archive(server, tmp_path):
+
+    download(server, tmp_path)
+
+    # extracted files missing: they are extracted from the archive, which isn't downloaded again
+    for name in FILES:
+        os.remove(tmp_path / 'MovieSummaries' / name)
+
+    download(server, tmp_path)
+    download(server, tmp_path, sha256=ARCHIVE_SHA256)
+
+    assert ArchiveHandler.requests == ['']
+    assert_extracted(tmp_path)
+
+
+def test_redownloads_corrupt_archive(server, tmp_path):
+
+    download(server, tmp_path)
+    (tmp_path / 'MovieSummaries.tar.gz').write_bytes(ARCHIVE[:-10])
+
+    download(server, tmp_path)
+
+    assert ArchiveHandler.requests == ['', '']
+    assert (tmp_path / 'MovieSummaries.tar.gz').read_bytes() == ARCHIVE
+
+
+def test_resumes_partial_download(server, tmp_path):
+
+    offset = len(ARCHIVE) // 2
+    (tmp_path / 'MovieSummaries.tar.gz.part').write_bytes(ARCHIVE[:offset])
+
+    download(server, tmp_path, sha256=ARCHIVE_SHA256)
+
+    assert ArchiveHandler.requests == [f'bytes={offset}-']
+    assert_extracted(tmp_path)
+    assert (tmp_path / 'MovieSummaries.tar.gz').read_bytes() == ARCHIVE
+    assert not (tmp_path / 'MovieSummaries.tar.gz.part').exists()
+
+
+def test_resumed_download_with_wrong_checksum(server, tmp_path):
+
+    offset = len(ARCHIVE) // 2
+    (tmp_path / 'MovieSummaries.tar.gz.part').write_bytes(ARCHIVE[:offset])
+
+    with pytest.raises(ValueError, match='Checksum mismatch'):
+        download(server, tmp_path, sha256='0' * 64)
+
+    assert ArchiveHandler.requests == [f'bytes={offset}-']
+    assert not (tmp_path / 'MovieSummaries.tar.gz').exists()
+    assert not (tmp_path / 'MovieSummaries.tar.gz.part').exists()  # so that the next attempt starts over
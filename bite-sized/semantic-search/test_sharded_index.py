@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_community.vectorstores import FAISS
+
+from columnar_docstore import ColumnarDocstore
+from populate_movie_faiss import build_index, load_vector_store, save_sharded_vector_store
+from sharded_index import iter_shards, merge_shards, num_shards_of
+
+DIM = 16
+
+
+def make_vector_store(index_spec, num_movies=300):
+
+    embeddings = DeterministicFakeEmbedding(size=DIM)
+    movie_ids = [str(movie_id) for movie_id in range(1000, 1000 + num_movies)]
+    docs = [Document(page_content=f'Plot of movie {movie_id}', metadata={'name': f'Movie {movie_id}',
+                                                                          'genres': ['Drama'], 'runtime': 90.})
+            for movie_id in movie_ids]
+
+    index = build_index(DIM, index_spec)
+    if not index.is_trained:
+        index.train(np.array(embeddings.embed_documents([doc.page_content for doc in docs]), dtype=np.float32))
+
+    vector_store = FAISS(embedding_function=embeddings, index=index, docstore=ColumnarDocstore(),
+                         index_to_docstore_id={})
+    vector_store.add_documents(docs, ids=movie_ids)
+
+    return vector_store, {movie_id: f'hash-{movie_id}' for movie_id in movie_ids}
+
+
+def vectors_by_id(vector_store):
+    return {doc_id: vector_store.index.reconstruct(position)
+            for position, doc_id in vector_store.index_to_docstore_id.items()}
+
+
+@pytest.mark.parametrize('index_spec', ['Flat', 'IVF4,Flat', 'HNSW16'])
+def test_merge_shards(index_spec):
+
+    vector_store, _ = make_vector_store(index_spec)
+
+    shards = list(iter_shards(vector_store, num_shards=3))  # gives IVF indexes the direct map needed to reconstruct
+    expected = vectors_by_id(vector_store)
+
+    merged = merge_shards(shards)
+
+    assert merged.index.ntotal == len(expected)
+
+    if index_spec.startswith('IVF'):
+        merged.index.make_direct_map()  # to reconstruct vectors by position
+    actual = vectors_by_id(merged)
+
+    assert actual.keys() == expected.keys()
+    assert all(np.allclose(actual[doc_id], expected[doc_id]) for doc_id in expected)
+
+
+@pytest.mark.parametrize('index_spec', ['Flat', 'HNSW16'])
+def test_load_sharded_vector_store(index_spec, tmp_path):
+
+    vector_store, content_hashes = make_vector_store(index_spec)
+    save_sharded_vector_store(vector_store, str(tmp_path), content_hashes, num_shards=3)
+
+    assert num_shards_of(str(tmp_path)) == 3
+
+    loaded, loaded_hashes = load_vector_store(str(tmp_path), vector_store.embedding_function)
+
+    assert loaded_hashes == content_hashes
+    assert loaded.index.ntotal == vector_store.index.ntotal
+
+    # every movie is still found by its own plot
+    for doc_id in ['1000', '1123', '1299']:
+        doc = loaded.docstore.search(doc_id)
+        assert loaded.similarity_search(doc.page_content, k=1)[0].id == doc_id
@@ -0,0 +1,119 @@
+import os
+import faiss
+import numpy as np
+
+
+VECTORS_FILENAME = 'vectors.npy'
+
+
+def quantized_index_path(save_dir, index_spec='SQ8'):
+    return os.path.join(save_dir, f"index_{index_spec.replace(',', '_')}.faiss")
+
+
+def write_vectors(index, save_dir, chunk_size=100_000):
+    """
+    Write the (float32) vectors of an index, in position order, to a .npy file that can be memory-mapped
+
+    Vectors are copied in chunks, so the index is never reconstructed in memory at once. Indexes that compress their
+    vectors (e.g. PQ) can only give back approximations of them.
+    """
+
+    if faiss.try_extract_index_ivf(index) is not None:
+        faiss.extract_index_ivf(index).make_direct_map()  # IVF indexes need it to reconstruct vectors by position
+
+    vectors = np.lib.format.open_memmap(os.path.join(save_dir, VECTORS_FILENAME), mode='w+', dtype=np.float32,
+                                        shape=(index.ntotal, index.d))
+
+    for start in range(0, index.ntotal, chunk_size):
+        end = min(start + chunk_size, index.ntotal)
+        vectors[start:end] = index.reconstruct_n(start, end - start)
+
+    vectors.flush()
+
+    return vectors
+
+
+def build_quantized_index(vectors, index_spec='SQ8', train_size=100_000, chunk_size=100_000):
+    """
+    Build a compressed copy of the vectors with a faiss index factory spec, e.g. 'SQ8' (int8, 4x smaller),
+    'SQ4' (8x smaller) or 'SQfp16' (2x smaller)
+    """
+
+    index = faiss.index_factory(vectors.shape[1], index_spec, faiss.METRIC_L2)
+
+    if not index.is_trained:
+        sample = np.random.default_rng(0).choice(len(vectors), size=min(train_size, len(vectors)), replace=False)
+        index.train(np.ascontiguousarray(vectors[np.sort(sample)]))
+
+    for start in range(0, len(vectors), chunk_size):
+        index.add(np.ascontiguousarray(vectors[start:start + chunk_size]))
+
+    return index
+
+
+def save_quantized_index(index, save_dir, index_spec='SQ8'):
+    """
+    Write the float32 vectors and a quantized copy of an index, i.e. the two files `TwoStageIndex` needs
+    """
+
+    vectors = write_vectors(index, save_dir)
+
+    faiss.write_index(build_quantized_index(vectors, index_spec=index_spec), quantized_index_path(save_dir, index_spec))
+
+
+class TwoStageIndex:
+    """
+    Two-stage search: a coarse search over quantized vectors held in RAM, followed by an exact rerank of the
+    `rerank_factor * k` best candidates with the float32 vectors, read from a memory-mapped file
+
+    Only the quantized vectors need to be resident, while the full-precision ones are paged in on demand (just the
+    candidates of each query). Quacks like a FAISS index (`search`, `reconstruct_batch`, `ntotal`, `d`), so it can be
+    used by `movie_search.MovieSearcher` in place of one.
+    """
+
+    def __init__(self, coarse_index, vectors, rerank_factor=4):
+        self.coarse_index = coarse_index
+        self.vectors = vectors
+        self.rerank_factor = rerank_factor
+
+    @property
+    def ntotal(self):
+        return self.coarse_index.ntotal
+
+    @property
+    def d(self):
+        return self.coarse_index.d
+
+    def reconstruct_batch(self, positions):
+        return np.asarray(self.vectors[np.asarray(positions)], dtype=np.float32)
+
+    def search(self, queries, k, params=None):
+
+        queries = np.asarray(queries, dtype=np.float32)
+
+        _, candidates = self.coarse_index.search(queries, k * self.rerank_factor, params=params)
+
+        distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+        positions = np.full((len(queries), k), -1, dtype=np.int64)
+
+        for i, (query, query_candidates) in enumerate(zip(queries, candidates)):
+
+            query_candidates = np.sort(query_candidates[query_candidates >= 0])  # sorted reads from the mmap
+
+            exact = ((self.reconstruct_batch(query_candidates) - query) ** 2).sum(axis=1)
+            top = np.argsort(exact)[:k]
+
+            distances[i, :len(top)] = exact[top]
+            positions[i, :len(top)] = query_candidates[top]
+
+        return distances, positions
+
+
+def load_two_stage_index(save_dir, index_spec='SQ8', rerank_factor=4):
+    """
+    Load the quantized index in RAM and memory-map the float32 vectors written by `save_quantized_index`
+    """
+
+    return TwoStageIndex(faiss.read_index(quantized_index_path(save_dir, index_spec)),
+                         np.load(os.path.join(save_dir, VECTORS_FILENAME), mmap_mode='r'),
+                         rerank_factor=rerank_factor)
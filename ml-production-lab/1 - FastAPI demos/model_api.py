@@ -1,10 +1,19 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import multiprocessing
+from contextlib import asynccontextmanager
 import numpy as np
+import asyncio
 import pickle
 import os
 
-app = FastAPI()
+# Inference settings
+# Note: model.predict() is a blocking call; if we ran it directly inside an `async def` endpoint, the whole server
+# (including requests to other endpoints) would wait for it. Instead we run it on a pool of threads or processes.
+EXECUTOR = os.environ.get('INFERENCE_EXECUTOR', 'thread')  # 'thread' or 'process'
+MAX_WORKERS = int(os.environ.get('INFERENCE_WORKERS', 4))
+MAX_IN_FLIGHT = int(os.environ.get('MAX_IN_FLIGHT', 32))  # requests over this limit are rejected with a 503
 
 # Load the pre-trained model
 # Note: this object is actually a sklearn Pipeline; it contains all preprocessing steps as well as the model.
@@ -15,6 +24,27 @@ with open(os.path.join(script_dir, 'resources/iris_model.pkl'), 'rb') as f:
 # Names of the classes in the iris dataset
 iris_target_names = ['setosa', 'versicolor', 'virginica']
 
+# Pool that runs the inference; created when the server starts and shut down when it stops
+executor = None
+
+# Number of requests currently being served
+in_flight = 0
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global executor
+    if EXECUTOR == 'process':
+        # process workers import this module, so each of them loads its own copy of the model
+        executor = ProcessPoolExecutor(MAX_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+    else:
+        executor = ThreadPoolExecutor(MAX_WORKERS)
+    yield
+    executor.shutdown(cancel_futures=True)
+
+
+app = FastAPI(lifespan=lifespan)
+
 
 # Define a data model for input validation
 class IrisInput(BaseModel):
@@ -24,6 +54,13 @@ class IrisInput(BaseModel):
     petal_width: float
 
 
+def run_inference(data):
+    """
+    Runs on the pool's threads/processes (it's defined at module level, so that it can be sent to a process)
+    """
+    return model.predict(data)
+
+
 @app.get('/')
 async def root():
     """
@@ -46,8 +83,17 @@ async def predict(iris_input: IrisInput):
         iris_input.petal_width
     ]])
 
-    # Perform inference
-    prediction = model.predict(data)
+    # Reject the request right away if too many are already waiting; queueing it would only make every request slower
+    global in_flight
+    if in_flight >= MAX_IN_FLIGHT:
+        raise HTTPException(status_code=503, detail='Server overloaded, retry later', headers={'Retry-After': '1'})
+
+    # Perform inference on the pool, without blocking the server
+    in_flight += 1
+    try:
+        prediction = await asyncio.get_running_loop().run_in_executor(executor, run_inference, data)
+    finally:
+        in_flight -= 1
 
     # Decode model prediction
     predicted_class = iris_target_names[prediction[0]]